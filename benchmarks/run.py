@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# --headless usa EGL (ARCADE_HEADLESS); tiene que decidirse antes de importar arcade
+if "--headless" in sys.argv:
+    os.environ["ARCADE_HEADLESS"] = "1"
+
+import storage
+from benchmarks.synth import make_drawing, CANVAS_H
+from main import WIDTH, HEIGHT, TITLE
+from spatial import SpatialIndex
+from store import TraceStore
+from tool import EraserTool
+
+# Métricas donde más alto es mejor; el resto son tiempos (más bajo es mejor).
+HIGHER_IS_BETTER = ("_per_s",)
+# parámetros que tienen que coincidir con los de la referencia para poder comparar
+SAME_CONFIG = ("traces", "seed", "erase_calls", "frames")
+
+
+def _pct(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def bench_erase(traces, calls: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    work = TraceStore(traces)
+    index = SpatialIndex()
+    index.rebuild(work)
+    eraser = EraserTool()
+    times = []
+    for _ in range(calls):
+        x = rng.uniform(0, WIDTH)
+        y = rng.uniform(0, CANVAS_H)
+        t0 = time.perf_counter()
+        eraser.erase_at(work, x, y, index=index)
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return {"erase_p50_ms": _pct(times, 0.5), "erase_p99_ms": _pct(times, 0.99)}
+
+
+def bench_storage(traces, tmpdir: str) -> dict:
+    out = {}
+    points = sum(len(t) for t in traces)
+    for label, encoding in (("delta", storage.ENC_DELTA), ("f32", storage.ENC_F32)):
+        path = os.path.join(tmpdir, f"bench_{label}.pva")
+        t0 = time.perf_counter()
+        storage.save(path, traces, encoding)
+        t1 = time.perf_counter()
+        loaded = storage.load(path)
+        t2 = time.perf_counter()
+        assert len(loaded) == len(traces)
+        out[f"save_{label}_points_per_s"] = points / (t1 - t0)
+        out[f"load_{label}_points_per_s"] = points / (t2 - t1)
+        out[f"file_{label}_bytes"] = os.path.getsize(path)
+    return out
+
+
+def bench_memory(n_traces: int, seed: int, tmpdir: str) -> dict:
+    tracemalloc.start()
+    traces = make_drawing(n_traces, seed)
+    build_peak = tracemalloc.get_traced_memory()[1]
+    path = os.path.join(tmpdir, "bench_mem.pva")
+    storage.save(path, traces)
+    del traces
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    loaded = storage.load(path)
+    load_peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    del loaded
+    return {"build_peak_bytes": build_peak, "load_peak_bytes": load_peak}
+
+
+def bench_render(traces, frames: int, tmpdir: str) -> dict:
+    import arcade
+    from main import Paint
+    path = os.path.join(tmpdir, "bench_render.pva")
+    storage.save(path, traces, storage.ENC_F32)
+    window = arcade.Window(WIDTH, HEIGHT, TITLE, visible=False)
+    try:
+        t0 = time.perf_counter()
+        app = Paint(path)
+        load_ms = (time.perf_counter() - t0) * 1000.0
+        window.show_view(app)
+
+        def frame(*regions):
+            app.dirty.update(regions)
+            t = time.perf_counter()
+            app.on_draw()
+            window.ctx.finish()
+            return (time.perf_counter() - t) * 1000.0
+
+        # el archivo llega en tandas desde un hilo: primer frame y carga completa
+        # (incluida la geometría retenida que se arma después) por separado
+        frame()
+        first_frame_ms = (time.perf_counter() - t0) * 1000.0
+        while app.loader is not None or any(layer.canvas.streaming for layer in app.layers):
+            app.on_update(1 / 60)
+            frame()
+        load_total_ms = (time.perf_counter() - t0) * 1000.0
+
+        rebake = []
+        for _ in range(max(3, frames // 20)):
+            app.canvas.invalidate()
+            rebake.append(frame("canvas"))
+        # frame recompuesto (algo cambió) y frame en reposo (solo se vuelve a pegar)
+        steady = [frame("canvas") for _ in range(frames)]
+        idle = [frame() for _ in range(frames)]
+        # _act_save solo encola la foto; el archivo queda escrito al cerrar el journal
+        t0 = time.perf_counter()
+        app._act_save()
+        save_ui_ms = (time.perf_counter() - t0) * 1000.0
+        app.journal.close()
+        save_total_ms = (time.perf_counter() - t0) * 1000.0
+    finally:
+        window.close()
+    return {
+        "paint_load_ms": load_ms,
+        "first_frame_ms": first_frame_ms,
+        "load_total_ms": load_total_ms,
+        "act_save_ui_ms": save_ui_ms,
+        "act_save_total_ms": save_total_ms,
+        "frame_p50_ms": _pct(steady, 0.5),
+        "frame_p99_ms": _pct(steady, 0.99),
+        "idle_frame_p50_ms": _pct(idle, 0.5),
+        "rebake_p50_ms": _pct(rebake, 0.5),
+    }
+
+
+def check_recovery() -> list[str]:
+    # ida y vuelta del autoguardado: una sesión dibuja y borra con el mouse, se cierra el
+    # journal sin guardar y una sesión nueva tiene que recuperar exactamente lo mismo
+    import arcade
+    from main import Paint
+    window = arcade.Window(WIDTH, HEIGHT, TITLE, visible=False)
+    try:
+        app = Paint()
+        # compactación frecuente: cae también justo después de un borrado con varias piezas
+        app.journal.compact_every = 5
+        window.show_view(app)
+        rng = random.Random(0)
+        left = arcade.MOUSE_BUTTON_LEFT
+        for act in [app._act_pencil] * 12 + [app._act_marker] * 6 + [app._act_eraser] * 6:
+            act()
+            x, y = rng.uniform(100, WIDTH - 100), rng.uniform(100, CANVAS_H - 100)
+            app.on_mouse_press(x, y, left, 0)
+            for _ in range(12):
+                x, y = x + rng.uniform(-25, 25), y + rng.uniform(-25, 25)
+                app.on_mouse_drag(x, y, 0, 0, left, 0)
+                app.on_update(1 / 60)
+            app.on_mouse_release(x, y, left, 0)
+        app._act_layer_opacity(-0.25)
+        drawn = [(l.name, l.visible, l.opacity, [(t.tool, bytes(t.coords)) for t in l.traces])
+                 for l in app.layers]
+        app.journal.close()
+        again = Paint()
+        again.journal.close()
+        recovered = [(l.name, l.visible, l.opacity, [(t.tool, bytes(t.coords)) for t in l.traces])
+                     for l in again.layers]
+    finally:
+        window.close()
+    if recovered != drawn:
+        return [f"recuperación: {sum(len(l[3]) for l in drawn)} trazos dibujados, "
+                f"{sum(len(l[3]) for l in recovered)} recuperados o distintos"]
+    return []
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for key, base in baseline.get("metrics", {}).items():
+        value = results["metrics"].get(key)
+        if value is None or not base:
+            continue
+        if key.endswith(HIGHER_IS_BETTER):
+            worse = value < base * (1.0 - threshold)
+        else:
+            worse = value > base * (1.0 + threshold)
+        if worse:
+            regressions.append(f"{key}: {base:.4g} -> {value:.4g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de render, borrado y guardado de PaintVA.")
+    parser.add_argument("--traces", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--erase-calls", type=int, default=2000)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--no-render", action="store_true", help="omite la medición con ventana")
+    parser.add_argument("--headless", action="store_true", help="ventana sin pantalla (EGL)")
+    parser.add_argument("--out", default="bench_output.json")
+    parser.add_argument("--baseline", help="JSON de referencia para comparar")
+    parser.add_argument("--save-baseline", help="guarda estos resultados como referencia")
+    parser.add_argument("--threshold", type=float, default=0.15, help="tolerancia de regresión (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        ref = baseline.get("config", {})
+        differ = [f"{key}={ref.get(key)}" for key in SAME_CONFIG if ref.get(key) != getattr(args, key)]
+        if differ:
+            parser.error(f"{args.baseline} se midió con otra configuración ({', '.join(differ)})")
+
+    traces = make_drawing(args.traces, args.seed)
+    results = {
+        "config": {"traces": args.traces, "seed": args.seed, "points": sum(len(t) for t in traces),
+                   "erase_calls": args.erase_calls, "frames": args.frames},
+        "machine": {"python": platform.python_version(), "platform": platform.platform()},
+        "metrics": {},
+        "skipped": {},
+    }
+    metrics = results["metrics"]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cwd = os.getcwd()
+        # el journal de Paint escribe autosave.* en el directorio actual
+        os.chdir(tmpdir)
+        try:
+            metrics.update(bench_erase(traces, args.erase_calls, args.seed))
+            metrics.update(bench_storage(traces, tmpdir))
+            metrics.update(bench_memory(args.traces, args.seed, tmpdir))
+            if args.no_render:
+                results["skipped"]["render"] = "--no-render"
+            else:
+                try:
+                    metrics.update(bench_render(traces, args.frames, tmpdir))
+                except Exception as e:
+                    results["skipped"]["render"] = f"{type(e).__name__}: {e}"
+                # la comprobación empieza sin autoguardado previo
+                for name in os.listdir(tmpdir):
+                    if name.startswith("autosave."):
+                        os.remove(name)
+                try:
+                    results["failures"] = check_recovery()
+                except Exception as e:
+                    results["skipped"]["recovery"] = f"{type(e).__name__}: {e}"
+        finally:
+            os.chdir(cwd)
+
+    if baseline is not None:
+        results["regressions"] = compare(results, baseline, args.threshold)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    for key, value in sorted(metrics.items()):
+        print(f"{key:<28} {value:,.3f}")
+    for key, why in results["skipped"].items():
+        print(f"omitido {key}: {why}")
+    for line in results.get("failures", []):
+        print(f"falla {line}")
+    if results.get("regressions"):
+        print("Regresiones:")
+        for line in results["regressions"]:
+            print(f"  {line}")
+    if results.get("regressions") or results.get("failures"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
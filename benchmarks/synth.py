@@ -0,0 +1,51 @@
+import math
+import random
+import numpy as np
+from tool import Trace, SprayTool, SprayCoverage
+from main import WIDTH, HEIGHT, TOPBAR_H, GRID_DEFAULT
+
+CANVAS_H = HEIGHT - TOPBAR_H
+COLORS = [(255, 0, 0, 255), (0, 128, 0, 255), (0, 0, 255, 255), (0, 0, 0, 255), (128, 0, 128, 255)]
+# proporción de trazos por herramienta (el borrador se mide aparte, sobre el dibujo)
+MIX = (("PENCIL", 0.35), ("MARKER", 0.2), ("SPRAY", 0.3), ("CELL", 0.15))
+
+
+def _walk(rng, n, step):
+    x = rng.uniform(0, WIDTH)
+    y = rng.uniform(0, CANVAS_H)
+    a = rng.uniform(0, 2 * math.pi)
+    pts = []
+    for _ in range(n):
+        a += rng.uniform(-0.4, 0.4)
+        x = min(max(x + step * math.cos(a), 0), WIDTH)
+        y = min(max(y + step * math.sin(a), 0), CANVAS_H)
+        pts.append((x, y))
+    return pts
+
+
+def make_drawing(n_traces: int, seed: int = 1234) -> list[Trace]:
+    rng = random.Random(seed)
+    spray_rng = np.random.default_rng(seed)
+    tools = [name for name, _ in MIX]
+    weights = [w for _, w in MIX]
+    traces = []
+    for _ in range(n_traces):
+        tool = rng.choices(tools, weights)[0]
+        color = rng.choice(COLORS)
+        if tool == "SPRAY":
+            coverage = SprayCoverage()
+            t = Trace(tool, color)
+            for (x, y) in _walk(rng, rng.randint(2, 12), 6.0):
+                t.extend(coverage.accept(SprayTool.scatter(x, y, rng=spray_rng)))
+            traces.append(t)
+        elif tool == "CELL":
+            size = GRID_DEFAULT
+            cells = []
+            for (x, y) in _walk(rng, rng.randint(1, 10), size):
+                c = (int(x // size) * size + size / 2, int(y // size) * size + size / 2)
+                if not cells or cells[-1] != c:
+                    cells.append(c)
+            traces.append(Trace(tool, color, cells, size))
+        else:
+            traces.append(Trace(tool, color, _walk(rng, rng.randint(5, 80), 3.0)))
+    return traces
@@ -0,0 +1,602 @@
+import math
+import time
+from bisect import insort
+import arcade
+from arcade.gl import geometry
+from arcade.shape_list import ShapeElementList
+from PIL import Image, ImageDraw
+from profiler import PROFILER
+from tool import Trace, CellTool
+
+CHUNK = 512.0      # lado de cada bloque de geometría retenida, en unidades del mundo
+CHUNK_PAD = 8.0    # margen por el grosor de las líneas (el marcador mide 10)
+REPAINT_REACH = 32.0  # lo más lejos de sus muestras en el índice que pinta un trazo (media celda de 48 y el margen)
+
+
+def lod_step(zoom: float) -> float:
+    # separación mínima entre puntos que todavía se distingue en pantalla (potencia de 2)
+    if zoom > 0.5:
+        return 0.0
+    return 2.0 ** math.floor(math.log2(1.0 / zoom))
+
+
+def view_of(camera) -> tuple:
+    # rectángulo visible (izq, abajo, der, arriba) en coordenadas del mundo
+    x, y = camera.position
+    p = camera.projection
+    return (x + p.left, y + p.bottom, x + p.right, y + p.top)
+
+
+_CELL_TEXTURES = {}
+
+
+def _cell_texture(size: int) -> arcade.Texture:
+    # relleno blanco (se tiñe con el color del sprite) y borde negro de 1px;
+    # una textura por tamaño, compartida por todos los segmentos de celdas
+    texture = _CELL_TEXTURES.get(size)
+    if texture is None:
+        img = Image.new("RGBA", (size, size), (255, 255, 255, 255))
+        ImageDraw.Draw(img).rectangle((0, 0, size - 1, size - 1), outline=(0, 0, 0, 255))
+        texture = arcade.Texture(img, hash=f"paintva-cell-{size}", hit_box_algorithm=arcade.hitbox.algo_bounding_box)
+        _CELL_TEXTURES[size] = texture
+    return texture
+
+
+class CellGrid:
+    # ocupación por (tamaño, columna, fila): cada celda distinta es un solo
+    # sprite y repintarla solo cambia su color (gana la última escritura). owners
+    # guarda, por celda, los trazos que la pintan en orden, para poder quitar uno
+    def __init__(self):
+        self.sprites = None
+        self.occupied = {}
+        self.owners = {}
+
+    def clear(self):
+        self.occupied.clear()
+        self.owners.clear()
+        if self.sprites is not None:
+            self.sprites.clear()
+
+    @staticmethod
+    def _cells(t: Trace) -> dict:
+        size = int(t.size)
+        return {(size, int(x // size), int(y // size)): (x, y) for (x, y) in t.points()}
+
+    def paint(self, t: Trace, traces=None):
+        # traces: el store, si t no va arriba de todo (deshacer en el medio)
+        if self.sprites is None:
+            self.sprites = arcade.SpriteList()
+        texture = _cell_texture(int(t.size))
+        for key, (x, y) in self._cells(t).items():
+            owners = self.owners.setdefault(key, [])
+            if traces is None:
+                owners.append(t)
+            else:
+                insort(owners, t, key=traces.index)
+            sprite = self.occupied.get(key)
+            if sprite is None:
+                sprite = arcade.Sprite(texture, center_x=x, center_y=y)
+                self.occupied[key] = sprite
+                self.sprites.append(sprite)
+            sprite.visible = True
+            sprite.color = owners[-1].color
+
+    def remove(self, t: Trace):
+        # la celda vuelve al color del trazo anterior que la pinta, o se oculta
+        for key in self._cells(t):
+            owners = self.owners.get(key)
+            if not owners:
+                continue
+            owners[:] = [o for o in owners if o is not t]
+            sprite = self.occupied[key]
+            if owners:
+                sprite.color = owners[-1].color
+            else:
+                del self.owners[key]
+                sprite.visible = False
+
+    def draw(self):
+        if self.sprites is not None:
+            self.sprites.draw()
+
+
+def trace_area(traces) -> tuple:
+    # caja (izq, abajo, der, arriba) de lo que pintan los trazos, con su grosor
+    area = [math.inf, math.inf, -math.inf, -math.inf]
+    for t in traces:
+        l, b, r, top = t.bounds()
+        pad = max(CHUNK_PAD, t.size)
+        area = [min(area[0], l - pad), min(area[1], b - pad), max(area[2], r + pad), max(area[3], top + pad)]
+    return tuple(area)
+
+
+def _chunk_key(t: Trace) -> tuple[int, int]:
+    l, b, r, top = t.bounds()
+    return (int((l + r) / 2 // CHUNK), int((b + top) / 2 // CHUNK))
+
+
+def _add_chunk(chunks: dict, tool, t: Trace, step: float):
+    # bloques de CHUNK x CHUNK con la caja que los envuelve, para saltar los que no se ven.
+    # Cada bloque: [geometría, izq, abajo, der, arriba, sus trazos en orden]
+    shapes = tool.make_shapes(t, step)
+    if not shapes:
+        return
+    l, b, r, top = t.bounds()
+    key = _chunk_key(t)
+    chunk = chunks.get(key)
+    if chunk is None:
+        chunk = [ShapeElementList(), l, b, r, top, []]
+        chunks[key] = chunk
+    else:
+        chunk[1] = min(chunk[1], l)
+        chunk[2] = min(chunk[2], b)
+        chunk[3] = max(chunk[3], r)
+        chunk[4] = max(chunk[4], top)
+    for shape in shapes:
+        chunk[0].append(shape)
+    chunk[5].append(t)
+
+
+def _rebuild_chunk(chunks: dict, key, tool, step: float):
+    # vuelve a armar un solo bloque con los trazos que le quedan
+    chunk = chunks.get(key)
+    if chunk is None:
+        return
+    batch = ShapeElementList()
+    box = [math.inf, math.inf, -math.inf, -math.inf]
+    kept = []
+    for t in chunk[5]:
+        shapes = tool.make_shapes(t, step)
+        if not shapes:
+            continue
+        for shape in shapes:
+            batch.append(shape)
+        l, b, r, top = t.bounds()
+        box = [min(box[0], l), min(box[1], b), max(box[2], r), max(box[3], top)]
+        kept.append(t)
+    if kept:
+        chunks[key] = [batch, *box, kept]
+    else:
+        del chunks[key]
+
+
+class _Segment:
+    # trazos consecutivos de una misma herramienta: se dibujan juntos y antes que el
+    # segmento siguiente, así se respeta el orden entre herramientas. Hay un bloque por
+    # nivel de detalle (step, 0 = todos los puntos): el primero se arma al dibujarlo y los
+    # demás de a poco (TraceBatches.warm_level); mientras, se dibuja el nivel más cercano
+    __slots__ = ("tool", "traces", "levels", "cells")
+
+    def __init__(self, tool_name: str):
+        self.tool = tool_name
+        self.traces = {}  # id(trazo) -> trazo; el orden lo da el store
+        self.levels = {}
+        self.cells = CellGrid() if tool_name == CellTool.name else None
+
+    def add(self, tool, t: Trace):
+        self.traces[id(t)] = t
+        if self.cells is not None:
+            self.cells.paint(t)
+            return
+        for step, chunks in self.levels.items():
+            _add_chunk(chunks, tool, t, step)
+
+    def insert(self, traces, t: Trace, touched: set):
+        # t en su lugar según el store; los bloques tocados se rearman después (touched)
+        self.traces[id(t)] = t
+        if self.cells is not None:
+            self.cells.paint(t, traces)
+            return
+        key = _chunk_key(t)
+        for step, chunks in self.levels.items():
+            chunk = chunks.get(key)
+            if chunk is None:
+                chunk = [None, 0.0, 0.0, 0.0, 0.0, []]
+                chunks[key] = chunk
+            insort(chunk[5], t, key=traces.index)
+            touched.add((self, step, key))
+
+    def remove(self, t: Trace, touched: set):
+        del self.traces[id(t)]
+        if self.cells is not None:
+            self.cells.remove(t)
+            return
+        key = _chunk_key(t)
+        for step, chunks in self.levels.items():
+            chunk = chunks.get(key)
+            # un trazo sin geometría (p. ej. de un solo punto) no quedó en ningún bloque
+            if chunk is not None and any(o is t for o in chunk[5]):
+                chunk[5] = [o for o in chunk[5] if o is not t]
+                touched.add((self, step, key))
+
+    def draw(self, tool, traces, step: float, view) -> bool:
+        # True si se dibujó otro nivel porque el pedido todavía no está armado
+        if self.cells is not None:
+            self.cells.draw()
+            return False
+        chunks = self.levels.get(step)
+        missing = chunks is None and bool(self.levels)
+        if missing:
+            chunks = self.levels[min(self.levels, key=lambda s: abs(s - step))]
+        elif chunks is None:
+            chunks = self.build(tool, traces, step)
+            self.levels[step] = chunks
+        for batch, l, b, r, t, _ in chunks.values():
+            if view is None or (l - CHUNK_PAD <= view[2] and r + CHUNK_PAD >= view[0] and
+                                b - CHUNK_PAD <= view[3] and t + CHUNK_PAD >= view[1]):
+                batch.draw()
+        return missing
+
+    def build(self, tool, traces, step: float) -> dict:
+        chunks = {}
+        for t in sorted(self.traces.values(), key=traces.index):
+            _add_chunk(chunks, tool, t, step)
+        return chunks
+
+
+class TraceBatches:
+    # geometría retenida de los trazos ya terminados, en segmentos que siguen el orden
+    # de dibujo; step es el nivel de detalle que se usa al dibujar. owner dice en qué
+    # segmento está cada trazo, para corregir solo ese segmento al borrar o deshacer
+    def __init__(self):
+        self.segments = []
+        self.owner = {}
+        self.step = 0.0
+        self.dirty = True
+
+    def commit(self, tool, t: Trace):
+        if not self.segments or self.segments[-1].tool != t.tool:
+            self.segments.append(_Segment(t.tool))
+        self.segments[-1].add(tool, t)
+        self.owner[id(t)] = self.segments[-1]
+
+    def rebuild(self, tools: dict, traces, live: Trace = None):
+        # las corridas del store (misma herramienta y color) se funden por herramienta
+        self.segments = []
+        self.owner = {}
+        for name, _color, start, stop in traces.runs():
+            tool = tools.get(name)
+            if tool is None:
+                continue
+            for t in traces[start:stop]:
+                if t is not live:
+                    self.commit(tool, t)
+        self.dirty = False
+
+    def replace(self, tools: dict, traces, removed, added) -> bool:
+        # `removed` ya salieron del store y `added` ya están en su lugar: se rearman solo
+        # los bloques donde estaban o caen esos trazos. False si no se pudo (todavía se
+        # está armando, o un trazo cae en medio de un segmento de otra herramienta y
+        # habría que partirlo): entonces queda todo por rearmar
+        if self.dirty:
+            return False
+        touched = set()
+        emptied = False
+        for t in removed:
+            seg = self.owner.pop(id(t), None)
+            if seg is not None:
+                seg.remove(t, touched)
+                emptied = emptied or not seg.traces
+        for t in added:
+            if tools.get(t.tool) is None:
+                continue
+            seg = self._segment_for(traces, t)
+            if seg is None:
+                self.dirty = True
+                return False
+            seg.insert(traces, t, touched)
+            self.owner[id(t)] = seg
+        for seg, step, key in touched:
+            _rebuild_chunk(seg.levels[step], key, tools.get(seg.tool), step)
+        if emptied:
+            self.segments = [seg for seg in self.segments if seg.traces]
+        return True
+
+    def _neighbour(self, traces, i: int, step: int):
+        # segmento del trazo armado más cercano antes (step -1) o después (+1) de i
+        i += step
+        while 0 <= i < len(traces):
+            seg = self.owner.get(id(traces[i]))
+            if seg is not None:
+                return seg
+            i += step
+        return None
+
+    def _segment_for(self, traces, t: Trace):
+        i = traces.index(t)
+        before = self._neighbour(traces, i, -1)
+        if before is not None and before.tool == t.tool:
+            return before
+        after = self._neighbour(traces, i, 1)
+        if after is not None and after.tool == t.tool:
+            return after
+        if before is not None and before is after:
+            return None
+        # entre dos segmentos de otras herramientas: uno nuevo entre ambos
+        seg = _Segment(t.tool)
+        self.segments.insert(self.segments.index(before) + 1 if before is not None else 0, seg)
+        return seg
+
+    def warm(self, tools: dict, traces):
+        # lo mismo que rebuild, pero de a un trazo por paso (generador, para repartirlo
+        # entre frames) y con la geometría del nivel actual ya armada y subida. Se arma
+        # aparte y se instala al final, así que lo que se agregue al store mientras tanto
+        # entra en el mismo recorrido (no debe haber un trazo en curso)
+        step = self.step
+        segments = []
+        owner = {}
+        i = 0
+        while i < len(traces):
+            t = traces[i]
+            i += 1
+            tool = tools.get(t.tool)
+            if tool is None:
+                continue
+            if not segments or segments[-1].tool != t.tool:
+                segments.append(_Segment(t.tool))
+                segments[-1].levels[step] = {}
+            segments[-1].add(tool, t)
+            owner[id(t)] = segments[-1]
+            yield
+        for seg in segments:
+            for batch, *_ in seg.levels[step].values():
+                batch.update()
+                batch.dirties.clear()
+                yield
+        self.segments = segments
+        self.owner = owner
+        self.dirty = False
+
+    def warm_level(self, tools: dict, traces):
+        # arma el nivel actual en los segmentos que todavía no lo tienen, de a un trazo por
+        # paso como warm; cada segmento lo instala al terminar. Si entre tanto cambian los
+        # trazos hay que empezar de nuevo (los segmentos ya terminados no se repiten)
+        step = self.step
+        for seg in list(self.segments):
+            if seg.cells is not None or step in seg.levels:
+                continue
+            tool = tools.get(seg.tool)
+            chunks = {}
+            for t in sorted(seg.traces.values(), key=traces.index):
+                _add_chunk(chunks, tool, t, step)
+                yield
+            for batch, *_ in chunks.values():
+                batch.update()
+                batch.dirties.clear()
+                yield
+            seg.levels[step] = chunks
+
+    def draw(self, tools: dict, traces, live: Trace = None, view=None) -> bool:
+        # True si algún segmento no tenía armado el nivel actual (ver warm_level)
+        if self.dirty:
+            self.rebuild(tools, traces, live)
+        missing = False
+        with PROFILER.section("bake"):
+            for seg in self.segments:
+                missing = seg.draw(tools.get(seg.tool), traces, self.step, view) or missing
+        return missing
+
+
+_OPACITY_VS = """
+#version 330
+in vec2 in_vert;
+in vec2 in_uv;
+out vec2 uv;
+void main() {
+    uv = in_uv;
+    gl_Position = vec4(in_vert, 0.0, 1.0);
+}
+"""
+_OPACITY_FS = """
+#version 330
+uniform sampler2D texture0;
+uniform float alpha;
+in vec2 uv;
+out vec4 color;
+void main() {
+    vec4 c = texture(texture0, uv);
+    color = vec4(c.rgb, c.a * alpha);
+}
+"""
+_OPACITY_PROGRAMS = {}
+
+
+def _opacity_program(ctx):
+    # como utility_textured_quad_program, pero con la transparencia de la capa
+    program = _OPACITY_PROGRAMS.get(ctx)
+    if program is None:
+        program = ctx.program(vertex_shader=_OPACITY_VS, fragment_shader=_OPACITY_FS)
+        _OPACITY_PROGRAMS[ctx] = program
+    return program
+
+
+class RenderLayer:
+    # textura del tamaño de la ventana que se pega en pantalla con un solo quad
+    def __init__(self):
+        self.fbo = None
+        self.quad = None
+
+    def ensure(self) -> bool:
+        # True si hubo que (re)crear la textura y por lo tanto está vacía
+        win = arcade.get_window()
+        size = win.get_framebuffer_size()
+        if self.fbo is not None and self.fbo.size == size:
+            return False
+        ctx = win.ctx
+        self.fbo = ctx.framebuffer(color_attachments=[ctx.texture(size, components=4)])
+        self.quad = geometry.quad_2d_fs()
+        return True
+
+    def activate(self):
+        return self.fbo.activate()
+
+    def clear(self):
+        self.fbo.clear(color=(0, 0, 0, 0))
+
+    def draw(self, alpha: float = 1.0):
+        ctx = self.fbo.ctx
+        ctx.enable(ctx.BLEND)
+        self.fbo.color_attachments[0].use(0)
+        if alpha >= 1.0:
+            self.quad.render(ctx.utility_textured_quad_program)
+        else:
+            # el alfa del destino se acumula en vez de multiplicarse: el frame sigue opaco
+            program = _opacity_program(ctx)
+            program["alpha"] = alpha
+            blend = ctx.blend_func
+            ctx.blend_func = ctx.SRC_ALPHA, ctx.ONE_MINUS_SRC_ALPHA, ctx.ONE, ctx.ONE_MINUS_SRC_ALPHA
+            self.quad.render(program)
+            ctx.blend_func = blend
+
+
+class BakedCanvas:
+    # framebuffer fuera de pantalla con todos los trazos terminados vistos desde la
+    # cámara; cada frame solo se pega la textura y encima el trazo en curso.
+    # Mover o acercar la cámara vuelve a pintar desde la geometría retenida
+    def __init__(self):
+        self.batches = TraceBatches()
+        self.pending = []
+        self.areas = []
+        self.target = RenderLayer()
+        self.view = None
+        self.dirty = True
+        self.streaming = False
+        self.leveling = False  # falta armar el nivel de detalle actual en algún segmento
+        self.warming = None
+
+    def invalidate(self):
+        self.batches.dirty = True
+        self.warming = None
+        self.leveling = False
+        self.pending.clear()
+        self.areas.clear()
+        self.dirty = True
+
+    def edit(self, tools: dict, traces, removed, added, area=None):
+        # `removed` salieron del store y `added` quedaron en su lugar (borrar, deshacer): la
+        # geometría retenida se corrige solo en los bloques de esos trazos y la textura se
+        # repinta en `area` (izq, abajo, der, arriba en el mundo; por defecto, lo que cubren)
+        if not self.batches.replace(tools, traces, removed, added):
+            # se estaba armando (después de una carga) o habría que partir un segmento:
+            # igual que al cargar, se rearma después, de a poco (settle)
+            self.streaming = True
+            self.warming = None
+        elif self.leveling:
+            # el nivel a medio armar no tiene este cambio
+            self.warming = None
+        if removed and self.pending:
+            gone = {id(t) for t in removed}
+            self.pending = [t for t in self.pending if id(t) not in gone]
+        if not self.dirty:
+            self.areas.append(area if area is not None else trace_area([*removed, *added]))
+
+    def commit(self, tool, t: Trace):
+        if not self.batches.dirty:
+            self.batches.commit(tool, t)
+            if self.leveling:
+                self.warming = None
+        if not self.dirty:
+            self.pending.append(t)
+
+    def stream(self, traces):
+        # trazos que llegan por tandas (carga en segundo plano): se pintan sueltos sobre
+        # la textura y la geometría retenida se arma después, de a poco (settle)
+        self.streaming = True
+        self.batches.dirty = True
+        if not self.dirty:
+            self.pending.extend(traces)
+
+    def settle(self, tools: dict, traces, deadline: float) -> bool:
+        # avanza el armado de la geometría (toda, o solo el nivel de detalle que falta)
+        # hasta `deadline` (perf_counter); True cuando terminó y el lienzo vuelve a
+        # dibujarse desde ella
+        if self.warming is None:
+            warm = self.batches.warm if self.streaming else self.batches.warm_level
+            self.warming = warm(tools, traces)
+        for _ in self.warming:
+            if time.perf_counter() >= deadline:
+                return False
+        self.warming = None
+        self.streaming = False
+        self.leveling = False
+        self.pending.clear()
+        self.dirty = True
+        return True
+
+    def bake(self, tools: dict, traces, live: Trace, camera, index=None):
+        if self.target.ensure():
+            self.dirty = True
+        view = view_of(camera)
+        if view != self.view:
+            self.view = view
+            self.dirty = True
+            self.batches.step = lod_step(camera.zoom)
+        if not self.dirty and not self.pending and not self.areas:
+            return
+        with self.target.activate(), camera.activate():
+            if self.dirty:
+                self.target.clear()
+                if self.streaming:
+                    self._draw_runs(tools, traces, view)
+                elif self.batches.draw(tools, traces, live, view):
+                    # acercar o alejar cambió el nivel de detalle: se arma de a poco (settle)
+                    self.leveling = True
+                self.dirty = False
+            else:
+                for area in self.areas:
+                    self._redraw_area(tools, traces, live, index, camera, area)
+                for t in self.pending:
+                    tool = tools.get(t.tool)
+                    if tool is not None:
+                        tool.draw_traces([t], view)
+            self.pending.clear()
+            self.areas.clear()
+
+    def _redraw_area(self, tools: dict, traces, live, index, camera, area):
+        # se borra el rectángulo en la textura y se vuelve a pintar recortado (scissor)
+        # con los trazos que lo tocan, en orden. Los candidatos salen del índice
+        # espacial de la capa; sin índice se recorre todo
+        fbo = self.target.fbo
+        ratio = fbo.width / arcade.get_window().width
+        x0, y0 = camera.project((area[0], area[1]))
+        x1, y1 = camera.project((area[2], area[3]))
+        left = max(0, math.floor(x0 * ratio) - 1)
+        bottom = max(0, math.floor(y0 * ratio) - 1)
+        right = min(fbo.width, math.ceil(x1 * ratio) + 1)
+        top = min(fbo.height, math.ceil(y1 * ratio) + 1)
+        if right <= left or top <= bottom:
+            return
+        box = (left, bottom, right - left, top - bottom)
+        fbo.clear(color=(0, 0, 0, 0), viewport=box)
+        fbo.scissor = box
+        near = traces if index is None else sorted(index.query(area, REPAINT_REACH), key=traces.index)
+        run = []
+        for t in near:
+            if t is live or not t.intersects(area, max(CHUNK_PAD, t.size)):
+                continue
+            if run and run[-1].tool != t.tool:
+                self._draw_run(tools, run, area)
+                run = []
+            run.append(t)
+        if run:
+            self._draw_run(tools, run, area)
+        fbo.scissor = None
+
+    @staticmethod
+    def _draw_run(tools: dict, run, view):
+        tool = tools.get(run[0].tool)
+        if tool is not None:
+            tool.draw_traces(run, view)
+
+    @staticmethod
+    def _draw_runs(tools: dict, traces, view):
+        # mientras se carga no conviene rearmar la geometría a cada tanda: se dibuja
+        # directo, corrida por corrida para respetar el orden
+        for name, _color, start, stop in traces.runs():
+            tool = tools.get(name)
+            if tool is not None:
+                tool.draw_traces(traces[start:stop], view)
+
+    def draw(self, tools: dict, traces, live: Trace, camera, alpha: float = 1.0, index=None):
+        self.bake(tools, traces, live, camera, index)
+        self.target.draw(alpha)
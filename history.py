@@ -0,0 +1,75 @@
+from collections import deque
+from tool import Trace
+
+# Deshacer/rehacer por deltas. Los trazos terminados no se modifican nunca,
+# así que cada operación guarda referencias a ellos en lugar de copias, junto con
+# la capa donde ocurrió (las capas no se borran, así que la referencia sigue valiendo):
+#   ("add", [(i, t)], capa)      se agregó t en la posición i
+#   ("erase", [(i, t, pedazos)...], capa) en ese orden, t se reemplazó por los pedazos
+#                                que quedaron tras el borrador (a partir de i; ninguno
+#                                si se borró entero)
+#   ("clear", [t...], capa)      se limpió la capa
+MAX_BYTES = 64 * 1024 * 1024
+MAX_OPS = 1000
+TRACE_OVERHEAD = 96
+
+
+def _op_bytes(op) -> int:
+    kind, data, _layer = op
+    if kind == "clear":
+        traces = data
+    elif kind == "add":
+        traces = [t for _, t in data]
+    else:
+        traces = [p for _, t, pieces in data for p in (t, *pieces)]
+    return sum(TRACE_OVERHEAD + len(t.coords) * 4 for t in traces)
+
+
+class History:
+    def __init__(self, max_bytes: int = MAX_BYTES, max_ops: int = MAX_OPS):
+        self.max_bytes = max_bytes
+        self.max_ops = max_ops
+        self.undo_ops = deque()
+        self.redo_ops = []
+        self.bytes = 0
+
+    def clear(self):
+        self.undo_ops.clear()
+        self.redo_ops.clear()
+        self.bytes = 0
+
+    def record_add(self, index: int, t: Trace, layer=None):
+        self._push(("add", [(index, t)], layer))
+
+    def record_erase(self, edits: list[tuple[int, Trace, list[Trace]]], layer=None):
+        self._push(("erase", list(edits), layer))
+
+    def record_clear(self, traces: list[Trace], layer=None):
+        if traces:
+            self._push(("clear", list(traces), layer))
+
+    def _push(self, op):
+        self.redo_ops.clear()
+        size = _op_bytes(op)
+        self.undo_ops.append((op, size))
+        self.bytes += size
+        # se olvida lo más antiguo cuando se pasa del límite de memoria
+        while self.undo_ops and (self.bytes > self.max_bytes or len(self.undo_ops) > self.max_ops):
+            _, old = self.undo_ops.popleft()
+            self.bytes -= old
+
+    def undo(self):
+        if not self.undo_ops:
+            return None
+        op, size = self.undo_ops.pop()
+        self.bytes -= size
+        self.redo_ops.append((op, size))
+        return op
+
+    def redo(self):
+        if not self.redo_ops:
+            return None
+        op, size = self.redo_ops.pop()
+        self.undo_ops.append((op, size))
+        self.bytes += size
+        return op
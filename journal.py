@@ -0,0 +1,205 @@
+import os
+import queue
+import shutil
+import struct
+import threading
+import zlib
+import storage
+from tool import Trace
+
+# Cada registro: longitud (u32), crc32 (u32) y el contenido. Los de trazos llevan
+# después del tipo la posición de la capa (u16):
+#   b"A" + capa + trazo empaquetado        trazo terminado
+#   b"I" + capa + índice u32 + trazo       trazo reinsertado (deshacer/rehacer)
+#   b"E" + capa + índices u32              trazos borrados (en el orden en que se quitaron)
+#   b"C" + capa                            limpiar la capa
+#   b"L" + posición u16 + nombre utf-8     capa nueva
+#   b"M" + desde u16 + hasta u16           capa movida
+#   b"P" + capa + visible u8 + opacidad f32
+# Un registro cortado por un cierre inesperado se descarta al recuperar.
+FRAME = struct.Struct("<II")
+LAYER_REF = struct.Struct("<H")
+LAYER_MOVE = struct.Struct("<HH")
+LAYER_PROPS = struct.Struct("<HBf")
+COMPACT_EVERY = 500
+
+
+class Journal:
+    def __init__(self, base: str = "autosave", compact_every: int = COMPACT_EVERY):
+        self.snapshot_path = base + ".pva"
+        self.log_path = base + ".log"
+        self.prev_path = base + ".prev.pva"
+        self.compact_every = compact_every
+        self.layers = []
+        self.since_snapshot = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.log_path)
+
+    def attach(self, layers: list):
+        # cualquier lista de objetos con name, visible, opacity y traces
+        self.layers = layers
+
+    # ---- hilo de interfaz: solo encola ----
+    def add(self, layer: int, t: Trace):
+        self._record(("A", (layer, t)))
+
+    def insert(self, layer: int, index: int, t: Trace):
+        self._record(("I", (layer, index, t)))
+
+    def erase(self, layer: int, indices: list[int]):
+        self._record(("E", (layer, list(indices))))
+
+    def clear(self, layer: int):
+        self._record(("C", layer))
+
+    def add_layer(self, pos: int, name: str):
+        self._record(("L", (pos, name)))
+
+    def move_layer(self, src: int, dst: int):
+        self._record(("M", (src, dst)))
+
+    def layer_props(self, layer: int, visible: bool, opacity: float):
+        self._record(("P", (layer, visible, opacity)))
+
+    def rotate(self):
+        # antes de la primera foto de una sesión que no recuperó el autoguardado (se abrió
+        # un archivo): lo de la sesión anterior (foto + log) queda en prev_path
+        self.queue.put(("R", None))
+
+    def checkpoint(self, live: Trace = None):
+        # la compactación se pide entre operaciones, nunca desde un registro: a mitad de
+        # una operación la foto ya vería cambios cuyos registros todavía no se encolaron
+        if self.since_snapshot >= self.compact_every:
+            self.snapshot(live=live)
+
+    def snapshot(self, export_path: str = None, live: Trace = None):
+        # el trazo en curso ya está en su capa pero su registro A llega al terminarlo
+        self.since_snapshot = 0
+        layers = [(l.name, l.visible, l.opacity, [t for t in l.traces if t is not live]) for l in self.layers]
+        self.queue.put(("S", (layers, export_path)))
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _record(self, item):
+        self.queue.put(item)
+        self.since_snapshot += 1
+
+    # ---- hilo de escritura ----
+    def _run(self):
+        log = open(self.log_path, "ab")
+        while True:
+            item = self.queue.get()
+            while item is not None:
+                kind, data = item
+                try:
+                    if kind == "S":
+                        log = self._compact(log, *data)
+                    elif kind == "R":
+                        log.flush()
+                        self._rotate()
+                    else:
+                        payload = self._encode(kind, data)
+                        log.write(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+                except Exception as e:
+                    print(f"No se pudo escribir el autoguardado: {e}")
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            log.flush()
+            os.fsync(log.fileno())
+            if item is None:
+                log.close()
+                return
+
+    @staticmethod
+    def _encode(kind: str, data) -> bytes:
+        if kind == "A":
+            return b"A" + LAYER_REF.pack(data[0]) + storage.pack_trace(data[1])
+        if kind == "I":
+            return b"I" + struct.pack("<HI", data[0], data[1]) + storage.pack_trace(data[2])
+        if kind == "E":
+            layer, indices = data
+            return b"E" + LAYER_REF.pack(layer) + struct.pack(f"<{len(indices)}I", *indices)
+        if kind == "C":
+            return b"C" + LAYER_REF.pack(data)
+        if kind == "L":
+            return b"L" + LAYER_REF.pack(data[0]) + data[1].encode("utf-8")
+        if kind == "M":
+            return b"M" + LAYER_MOVE.pack(*data)
+        return b"P" + LAYER_PROPS.pack(*data)
+
+    def _compact(self, log, layers: list, export_path: str):
+        storage.save_layers(self.snapshot_path, layers, storage.ENC_F32)
+        log.close()
+        log = open(self.log_path, "wb")
+        if export_path:
+            storage.save_layers(export_path, layers)
+            print(f"Guardado en {export_path}")
+        return log
+
+    def _rotate(self):
+        try:
+            layers = self.recover()
+        except Exception as e:
+            # no se pudo leer: se apartan los archivos tal cual
+            print(f"No se pudo leer el autoguardado anterior: {e}")
+            for path in (self.snapshot_path, self.log_path):
+                if os.path.exists(path):
+                    shutil.copyfile(path, path + ".prev")
+            return
+        if any(layer[3] for layer in layers):
+            storage.save_layers(self.prev_path, layers, storage.ENC_F32)
+            print(f"Autoguardado anterior guardado en {self.prev_path}")
+
+    # ---- recuperación ----
+    def recover(self) -> list[tuple[str, bool, float, list[Trace]]]:
+        # capas (nombre, visible, opacidad, trazos) de abajo hacia arriba
+        layers = []
+        if os.path.exists(self.snapshot_path):
+            layers = [list(layer) for layer in storage.load_layers(self.snapshot_path)]
+        if not os.path.exists(self.log_path):
+            return [tuple(layer) for layer in layers]
+        with open(self.log_path, "rb") as f:
+            buf = f.read()
+        pos = 0
+        while pos + FRAME.size <= len(buf):
+            size, crc = FRAME.unpack_from(buf, pos)
+            payload = buf[pos + FRAME.size:pos + FRAME.size + size]
+            if len(payload) < size or zlib.crc32(payload) != crc:
+                break
+            pos += FRAME.size + size
+            kind = payload[:1]
+            if kind == b"L":
+                (at,) = LAYER_REF.unpack_from(payload, 1)
+                layers.insert(at, [payload[3:].decode("utf-8"), True, 1.0, []])
+                continue
+            if kind == b"M":
+                src, dst = LAYER_MOVE.unpack_from(payload, 1)
+                layers.insert(dst, layers.pop(src))
+                continue
+            if kind == b"P":
+                li, visible, opacity = LAYER_PROPS.unpack_from(payload, 1)
+                layers[li][1:3] = [bool(visible), round(opacity, 4)]
+                continue
+            (li,) = LAYER_REF.unpack_from(payload, 1)
+            while len(layers) <= li:
+                layers.append([storage.DEFAULT_LAYER if not layers else f"Capa {len(layers) + 1}", True, 1.0, []])
+            traces = layers[li][3]
+            if kind == b"A":
+                traces.append(storage.unpack_trace(memoryview(payload)[3:]))
+            elif kind == b"I":
+                (i,) = struct.unpack_from("<I", payload, 3)
+                traces.insert(i, storage.unpack_trace(memoryview(payload)[7:]))
+            elif kind == b"E":
+                for i in struct.unpack(f"<{(size - 3) // 4}I", payload[3:]):
+                    del traces[i]
+            elif kind == b"C":
+                traces.clear()
+        return [tuple(layer) for layer in layers]
@@ -0,0 +1,16 @@
+from canvas import BakedCanvas
+from spatial import SpatialIndex
+from store import TraceStore
+
+
+class Layer:
+    # una capa: sus trazos en orden, su índice espacial y su propia textura horneada.
+    # Editar una capa solo vuelve a hornear esa capa; el frame compone las texturas
+    # de las capas visibles de abajo hacia arriba, cada una con su opacidad
+    def __init__(self, name: str, traces=(), visible: bool = True, opacity: float = 1.0):
+        self.name = name
+        self.traces = TraceStore(traces)
+        self.index = SpatialIndex()
+        self.canvas = BakedCanvas()
+        self.visible = visible
+        self.opacity = opacity
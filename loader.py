@@ -0,0 +1,76 @@
+import queue
+import threading
+import storage
+from spatial import SpatialIndex
+
+BATCH = 64  # trazos por tanda que se entrega a la ventana
+
+
+class TraceLoader:
+    # Lee un dibujo en un hilo de fondo y lo entrega en tandas de BATCH trazos, que la
+    # ventana va agregando frame a frame. El hilo también calcula las cajas y arma el
+    # índice espacial de cada capa, que se entregan completos al terminar (hasta
+    # entonces no se edita).
+    def __init__(self, path: str, default_size: int = 16, batch: int = BATCH):
+        self.path = path
+        self.total = 0  # 0 = todavía no se sabe cuántos trazos hay
+        self.received = 0
+        self.layers = None  # [(nombre, visible, opacidad, cantidad)] en cuanto se lee la cabecera
+        self.indexes = []
+        self.error = None
+        self.done = False
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, args=(default_size, batch), daemon=True)
+        self.thread.start()
+
+    def progress(self) -> float:
+        return self.received / self.total if self.total else 0.0
+
+    def take_layers(self):
+        # las capas del archivo, una sola vez, en cuanto el hilo leyó la cabecera
+        layers, self.layers = self.layers, None
+        return layers
+
+    def next_batch(self):
+        # (posición de la capa, trazos) de una tanda lista, o None si todavía no
+        # llegó ninguna (nunca bloquea)
+        if self.done:
+            return None
+        try:
+            item = self.queue.get_nowait()
+        except queue.Empty:
+            return None
+        if item is None:
+            self.done = True
+            return None
+        self.received += len(item[1])
+        return item
+
+    def _run(self, default_size: int, size: int):
+        try:
+            if storage.is_binary(self.path):
+                layers = storage.read_layers(self.path)
+                traces = storage.iter_traces(self.path)
+            else:
+                traces = storage.load_legacy_txt(self.path, default_size)
+                layers = [(storage.DEFAULT_LAYER, True, 1.0, len(traces))]
+                traces = iter(traces)
+            self.total = sum(layer[3] for layer in layers)
+            self.layers = layers
+            for li, (_name, _visible, _opacity, count) in enumerate(layers):
+                index = SpatialIndex()
+                self.indexes.append(index)
+                batch = []
+                for _ in range(count):
+                    t = next(traces)
+                    t.bounds()
+                    index.add_trace(t)
+                    batch.append(t)
+                    if len(batch) >= size:
+                        self.queue.put((li, batch))
+                        batch = []
+                if batch:
+                    self.queue.put((li, batch))
+        except Exception as e:
+            self.error = e
+        self.queue.put(None)
@@ -1,8 +1,17 @@
+import math
 import sys
-import ast
+import time
 import arcade
-import pyglet  # fallback para capturar el buffer si tu Arcade no trae get_image()
-from tool import PencilTool, MarkerTool, SprayTool, EraserTool, CellTool
+import numpy as np
+from arcade.shape_list import ShapeElementList, create_line, create_lines
+from tool import Trace, StrokeSimplifier, SprayCoverage, bresenham, PencilTool, MarkerTool, SprayTool, EraserTool, CellTool, FillTool
+from canvas import CHUNK_PAD, RenderLayer, view_of
+from layers import Layer
+from history import History
+from profiler import PROFILER, REFRESH_FRAMES
+from journal import Journal
+from loader import TraceLoader
+from storage import DEFAULT_LAYER
 
 WIDTH = 900
 HEIGHT = 600
@@ -20,6 +29,25 @@ GRID_DEFAULT = 24
 GRID_MIN = 8
 GRID_MAX = 48
 RULE_SPACING = 22
+SAVE_PATH = "dibujo.pva"
+SIMPLIFY_TOLERANCE = 1.0
+# Shift+P exporta a 4x; con Alt también, a 2x y con Ctrl también, a 8x
+EXPORT_HIRES_SCALE = 4
+EXPORT_HIRES_LOW = 2
+EXPORT_HIRES_HIGH = 8
+EXPORT_TILE = 1024
+# con True solo se recompone el frame cuando algo cambió; si no, se vuelve a
+# pegar el último frame guardado en una textura
+ON_DEMAND_RENDER = True
+# lienzo infinito: rueda = zoom hacia el cursor, arrastre con botón derecho/medio = mover
+ZOOM_MIN = 0.05
+ZOOM_MAX = 8.0
+ZOOM_STEP = 1.1
+MIN_LINE_GAP = 4  # px en pantalla por debajo de los cuales no se dibujan rayas ni cuadrícula
+OPACITY_STEP = 0.1
+OPACITY_MIN = 0.1
+# el archivo de la línea de comandos se lee en un hilo; cada frame agrega tandas hasta gastar esto (s)
+LOAD_BUDGET = 0.008
 
 C_BG = arcade.color.WHITE
 C_TOP1 = arcade.color.PALE_GOLDENROD
@@ -40,6 +68,8 @@ PAPER_NONE = "NONE"
 PAPER_RULED_BR = "RULED_BR"
 PAPER_RULED_BLACK = "RULED_BLACK"
 
+TOOL_CLASSES = {cls.name: cls for cls in (PencilTool, MarkerTool, SprayTool, EraserTool, CellTool, FillTool)}
+
 
 class Button:
     def __init__(self, x, y, label, kind, action):
@@ -50,6 +80,7 @@ class Button:
         self.kind = kind
         self.action = action
         self.hover = False
+        self.texts = None
 
     def contains(self, x, y):
         rx, ry, rw, rh = self.rect
@@ -99,10 +130,15 @@ class Button:
         border_w = 2 if active else 1
         arcade.draw_lrbt_rectangle_outline(rx, rx + rw, ry, ry + rh, border_color, border_width=border_w)
         self.draw_icon(rx, ry, rw, rh, C_BTN_TXT)
-        arcade.draw_text(self.label, rx + 35, ry + rh / 2 - 6, arcade.color.BLACK, 11,
-                         anchor_x="left", anchor_y="center")
-        arcade.draw_text(self.label, rx + 35, ry + rh / 2 - 7, C_BTN_TXT, 11,
-                         anchor_x="left", anchor_y="center")
+        if self.texts is None:
+            self.texts = (
+                arcade.Text(self.label, rx + 35, ry + rh / 2 - 6, arcade.color.BLACK, 11,
+                            anchor_x="left", anchor_y="center"),
+                arcade.Text(self.label, rx + 35, ry + rh / 2 - 7, C_BTN_TXT, 11,
+                            anchor_x="left", anchor_y="center"),
+            )
+        for text in self.texts:
+            text.draw()
 
 
 class Paint(arcade.View):
@@ -125,45 +161,85 @@ class Paint(arcade.View):
         self.grid_on = False
         self.grid_size = GRID_DEFAULT
         self.last_mouse = (0, 0)
+        self.paper_shapes = None
+        self.paper_key = None
+        self.grid_shapes = None
+        self.grid_key = None
+        self.chrome = RenderLayer()
+        self.chrome_key = None
+        self.frame = RenderLayer()
+        self.dirty = {"canvas", "chrome"}
+        self.texts = {}
+        self.exporter = None
 
-        self.traces = []
+        self.layers = [Layer(DEFAULT_LAYER)]
+        self.active = 0
+        self.live = None
+        self.camera = arcade.camera.Camera2D()
+        self.journal = Journal()
+        self.simplifier = StrokeSimplifier(SIMPLIFY_TOLERANCE)
+        self.spray = None  # (SprayCoverage, x, y) del spray presionado
+        self.spray_from = (0.0, 0.0)
+        self.spray_debt = 0.0
+        self.drag_queue = []
+        self.erase_from = None
+        self.erase_edits = []  # reemplazos del borrador desde que se presionó
+        self.history = History()
         self.btns_tools = []
         self.btns_actions = []
         self.swatches = []
         self.loaded_path = load_path if load_path else ""
+        self.loader = None
         self.help_text = ("A rojo  S verde  D azul  F negro  |  "
-                          "1 Lápiz 2 Marcador 3 Spray 4 Borrador 5 Celdas  |  "
-                          "O Guardar  P PNG  |  Cuadrícula:G  |  Papel:H  |  Arcoíris:R")
+                          "1 Lápiz 2 Marcador 3 Spray 4 Borrador 5 Celdas 6 Relleno  |  "
+                          "O Guardar  P PNG (Shift x4, +Alt x2, +Ctrl x8)  J JPG  |  Cuadrícula:G  |  Papel:H  |  Arcoíris:R")
 
         self._layout_build()
         if load_path is not None:
+            # la ventana se muestra enseguida y los trazos llegan por tandas (_pump_loader)
+            self.loader = TraceLoader(load_path, GRID_DEFAULT)
+            if self.journal.exists():
+                # la primera foto de esta sesión pisaría el autoguardado sin recuperar
+                self.journal.rotate()
+        elif self.journal.exists():
             try:
-                with open(load_path, "r", encoding="utf-8") as f:
-                    loaded = ast.literal_eval(f.read().strip())
-                if isinstance(loaded, list):
-                    for t in loaded:
-                        item = {
-                            "tool": t["tool"],
-                            "color": tuple(t["color"]),
-                            "trace": [tuple(p) for p in t["trace"]],
-                        }
-                        if t["tool"] == "CELL":
-                            item["size"] = t.get("size", GRID_DEFAULT)
-                        self.traces.append(item)
-                        if t["tool"] == "PENCIL" and "PENCIL" not in self.used_tools:
-                            self.used_tools["PENCIL"] = PencilTool()
-                        elif t["tool"] == "MARKER" and "MARKER" not in self.used_tools:
-                            self.used_tools["MARKER"] = MarkerTool()
-                        elif t["tool"] == "SPRAY" and "SPRAY" not in self.used_tools:
-                            self.used_tools["SPRAY"] = SprayTool()
-                        elif t["tool"] == "CELL" and "CELL" not in self.used_tools:
-                            self.used_tools["CELL"] = CellTool()
-                    print(f"Cargado: {load_path}")
-                else:
-                    print("Archivo inválido (se esperaba lista).")
+                recovered = [Layer(name, traces, visible, opacity)
+                             for name, visible, opacity, traces in self.journal.recover()]
+                if recovered:
+                    self.layers = recovered
+                print(f"Recuperado autoguardado ({self._trace_count()} trazos)")
             except Exception as e:
-                self.traces = []
-                print(f"No se pudo cargar {load_path}: {e}")
+                print(f"No se pudo recuperar el autoguardado: {e}")
+                # la foto de abajo lo pisaría: los archivos quedan apartados como *.prev
+                self.journal.rotate()
+        for layer in self.layers:
+            for name in layer.traces.tools():
+                if name not in self.used_tools:
+                    self.used_tools[name] = TOOL_CLASSES[name]()
+            layer.index.rebuild(layer.traces)
+        self.journal.attach(self.layers)
+        if self.loader is None:
+            self.journal.snapshot()
+
+    # traces, index y canvas son siempre los de la capa activa
+    @property
+    def layer(self) -> Layer:
+        return self.layers[self.active]
+
+    @property
+    def traces(self):
+        return self.layer.traces
+
+    @property
+    def index(self):
+        return self.layer.index
+
+    @property
+    def canvas(self):
+        return self.layer.canvas
+
+    def _trace_count(self) -> int:
+        return sum(len(layer.traces) for layer in self.layers)
 
     def _layout_build(self):
         left = PAD
@@ -230,25 +306,28 @@ class Paint(arcade.View):
 
         self.panel_rect = (WIDTH - PANEL_W - PAD, WIDTH - PAD, HEIGHT - TOPBAR_H + PAD, HEIGHT - PAD)
 
-    def _act_pencil(self):
-        self.tool = PencilTool()
+    def _use_tool(self, cls):
+        # se reutiliza la instancia para no perder su geometría ya subida
+        self.tool = self.used_tools.get(cls.name) or cls()
         self.used_tools[self.tool.name] = self.tool
 
+    def _act_pencil(self):
+        self._use_tool(PencilTool)
+
     def _act_marker(self):
-        self.tool = MarkerTool()
-        self.used_tools[self.tool.name] = self.tool
+        self._use_tool(MarkerTool)
 
     def _act_spray(self):
-        self.tool = SprayTool()
-        self.used_tools[self.tool.name] = self.tool
+        self._use_tool(SprayTool)
 
     def _act_eraser(self):
-        self.tool = EraserTool()
-        self.used_tools[self.tool.name] = self.tool
+        self._use_tool(EraserTool)
 
     def _act_cell(self):
-        self.tool = CellTool()
-        self.used_tools[self.tool.name] = self.tool
+        self._use_tool(CellTool)
+
+    def _act_fill(self):
+        self._use_tool(FillTool)
 
     def _act_grid_toggle(self):
         self.grid_on = not self.grid_on
@@ -265,29 +344,226 @@ class Paint(arcade.View):
         self.rainbow_on = not self.rainbow_on
 
     def _act_clear(self):
-        self.traces.clear()
+        # limpia la capa activa
+        if self.loader is not None:
+            return
+        self._commit_live()
+        self.history.record_clear(self.traces, self.layer)
+        self._clear_traces(self.layer)
+
+    # ---- capas ----
+    def _act_layer_add(self):
+        # la capa nueva va justo encima de la activa y pasa a ser la activa
+        if self.loader is not None:
+            return
+        self._commit_live()
+        pos = self.active + 1
+        name = f"Capa {len(self.layers) + 1}"
+        self.layers.insert(pos, Layer(name))
+        self.journal.add_layer(pos, name)
+        self.active = pos
+
+    def _act_layer_select(self, step: int):
+        self._commit_live()
+        self.active = min(len(self.layers) - 1, max(0, self.active + step))
+
+    def _act_layer_move(self, step: int):
+        # solo cambia el orden de composición: ninguna capa se vuelve a hornear
+        if self.loader is not None:
+            return
+        dst = self.active + step
+        if not 0 <= dst < len(self.layers):
+            return
+        self._commit_live()
+        self.layers.insert(dst, self.layers.pop(self.active))
+        self.journal.move_layer(self.active, dst)
+        self.active = dst
+
+    def _act_layer_visible(self):
+        if self.loader is not None:
+            return
+        self._commit_live()
+        self.layer.visible = not self.layer.visible
+        self.journal.layer_props(self.active, self.layer.visible, self.layer.opacity)
+
+    def _act_layer_opacity(self, delta: float):
+        if self.loader is not None:
+            return
+        self._commit_live()
+        self.layer.opacity = round(min(1.0, max(OPACITY_MIN, self.layer.opacity + delta)), 2)
+        self.journal.layer_props(self.active, self.layer.visible, self.layer.opacity)
+
+    def _act_undo(self):
+        if self.loader is not None:
+            return
+        self._commit_live()
+        op = self.history.undo()
+        if op is None:
+            return
+        kind, data, layer = op
+        if kind == "add":
+            self._repaint(layer, self._remove_traces(layer, [i for i, _ in data]), [])
+        elif kind == "erase":
+            removed, added = [], []
+            for i, t, pieces in reversed(data):
+                if pieces:
+                    removed += self._remove_traces(layer, list(range(i + len(pieces) - 1, i - 1, -1)))
+                added += self._insert_traces(layer, [(i, t)])
+            self._repaint(layer, removed, added)
+        else:
+            self._repaint(layer, [], self._insert_traces(layer, enumerate(data)))
+
+    def _act_redo(self):
+        if self.loader is not None:
+            return
+        self._commit_live()
+        op = self.history.redo()
+        if op is None:
+            return
+        kind, data, layer = op
+        if kind == "add":
+            self._repaint(layer, [], self._insert_traces(layer, data))
+        elif kind == "erase":
+            removed, added = [], []
+            for i, _t, pieces in data:
+                removed += self._remove_traces(layer, [i])
+                added += self._insert_traces(layer, enumerate(pieces, i))
+            self._repaint(layer, removed, added)
+        else:
+            self._clear_traces(layer)
+
+    # ---- cambios a los trazos de una capa: mantienen su índice, su lienzo y el journal al día ----
+    def _insert_traces(self, layer: Layer, items) -> list[Trace]:
+        # lo que queda arriba de todo va directo al lienzo; devuelve los trazos que
+        # quedaron en el medio, que el llamador pasa a _repaint
+        pos = self.layers.index(layer)
+        middle = []
+        for i, t in items:
+            layer.traces.insert(i, t)
+            layer.index.add_trace(t)
+            self.journal.insert(pos, i, t)
+            if t.tool not in self.used_tools:
+                self.used_tools[t.tool] = TOOL_CLASSES[t.tool]()
+            if i == len(layer.traces) - 1:
+                layer.canvas.commit(self.used_tools[t.tool], t)
+            else:
+                middle.append(t)
+        return middle
+
+    def _remove_traces(self, layer: Layer, indices: list[int]) -> list[Trace]:
+        # devuelve los trazos quitados, para _repaint
+        removed = []
+        for i in indices:
+            t = layer.traces[i]
+            layer.index.remove(t)
+            del layer.traces[i]
+            removed.append(t)
+        self.journal.erase(self.layers.index(layer), indices)
+        return removed
+
+    def _repaint(self, layer: Layer, removed, added, area=None):
+        # el lienzo de la capa se corrige solo donde cambió (BakedCanvas.edit). Un trazo
+        # que entró y salió en la misma operación nunca llegó al lienzo: no cuenta
+        created = {id(t): t for t in added}
+        removed = [t for t in removed if created.pop(id(t), None) is None]
+        if removed or created:
+            layer.canvas.edit(self.used_tools, layer.traces, removed, list(created.values()), area)
+
+    def _clear_traces(self, layer: Layer):
+        layer.traces.clear()
+        layer.index.clear()
+        layer.canvas.invalidate()
+        self.journal.clear(self.layers.index(layer))
 
     def _act_save(self):
+        # el archivo se escribe en el hilo del journal junto con la compactación
+        if self.loader is not None:
+            print("Todavía se está cargando el dibujo")
+            return
+        self._commit_live()
+        self.journal.snapshot(SAVE_PATH)
+
+    def _act_export_png(self, filename: str = "drawing.png", scale: int = 1):
+        # en el hilo de la interfaz solo se lee el área del lienzo (o se copian las
+        # referencias a los trazos); el render en mosaicos y la codificación van aparte
+        if self.loader is not None:
+            print("Todavía se está cargando el dibujo")
+            return
+        if self.exporter is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.exporter = ThreadPoolExecutor(max_workers=1)
         try:
-            with open("dibujo.txt", "w", encoding="utf-8") as f:
-                f.write(repr(self.traces))
-            print("Guardado en dibujo.txt")
+            self._commit_live()
+            if scale == 1:
+                # se lee la textura de cada capa visible; la composición va en el hilo
+                parts = []
+                size = None
+                for layer in self.layers:
+                    if not layer.visible:
+                        continue
+                    layer.canvas.bake(self.used_tools, layer.traces, None, self.camera, layer.index)
+                    fbo = layer.canvas.target.fbo
+                    ratio = fbo.width / WIDTH
+                    size = (fbo.width, round((HEIGHT - TOPBAR_H) * ratio))
+                    parts.append((fbo.read(viewport=(0, 0, size[0], size[1]), components=4), layer.opacity))
+                if size is None:
+                    fbo = self.frame.fbo
+                    size = (fbo.width, round((HEIGHT - TOPBAR_H) * fbo.width / WIDTH))
+                self.exporter.submit(self._encode_readback, parts, size, filename)
+            else:
+                # la zona visible del lienzo, a `scale` veces su tamaño en pantalla
+                left, bottom = self._to_world(0, 0)
+                right, top = self._to_world(WIDTH, HEIGHT - TOPBAR_H)
+                layers = [(l.name, l.visible, l.opacity, list(l.traces)) for l in self.layers]
+                self.exporter.submit(self._encode_hires, layers, scale * self.camera.zoom,
+                                     (left, bottom, right, top), filename)
         except Exception as e:
-            print(f"No se pudo guardar: {e}")
+            print(f"No se pudo exportar {filename}: {e}")
+
+    @staticmethod
+    def _save_image(img, filename):
+        if filename.lower().endswith((".jpg", ".jpeg")):
+            img.save(filename, quality=92)
+        else:
+            img.save(filename)
+        print(f"Imagen guardada como {filename}")
 
-    def _act_export_png(self, filename: str = "drawing.png"):
+    def _encode_readback(self, parts, size, filename):
         try:
-            win = getattr(arcade, "get_window", lambda: None)()
-            if win and hasattr(win, "get_image"):
-                img = win.get_image()
-                img.save(filename)
-                print(f"Imagen guardada como {filename}")
-                return
-            buffer = pyglet.image.get_buffer_manager().get_color_buffer()
-            buffer.save(filename)
-            print(f"Imagen guardada como {filename}")
+            from PIL import Image
+            out = Image.new("RGBA", size, tuple(C_BG))
+            for data, opacity in parts:
+                img = Image.frombytes("RGBA", size, data).transpose(Image.Transpose.FLIP_TOP_BOTTOM)
+                if opacity < 1.0:
+                    img.putalpha(img.getchannel("A").point(lambda a: round(a * opacity)))
+                out.alpha_composite(img)
+            self._save_image(out.convert("RGB"), filename)
+        except Exception as e:
+            print(f"No se pudo exportar {filename}: {e}")
+
+    def _encode_hires(self, layers, scale, region, filename):
+        try:
+            import render
+            img = render.render_tiled(layers, scale, EXPORT_TILE, tuple(C_BG)[:3], region)
+            self._save_image(img, filename)
         except Exception as e:
-            print(f"No se pudo exportar PNG: {e}")
+            print(f"No se pudo exportar {filename}: {e}")
+
+    def _to_world(self, x, y):
+        wx, wy, _ = self.camera.unproject((x, y))
+        return wx, wy
+
+    def _zoom_at(self, x, y, factor):
+        # el punto bajo el cursor queda fijo
+        before = self._to_world(x, y)
+        self.camera.zoom = min(ZOOM_MAX, max(ZOOM_MIN, self.camera.zoom * factor))
+        after = self._to_world(x, y)
+        cx, cy = self.camera.position
+        self.camera.position = (cx + before[0] - after[0], cy + before[1] - after[1])
+
+    def _act_reset_view(self):
+        self.camera.zoom = 1.0
+        self.camera.position = (WIDTH / 2, HEIGHT / 2)
 
     def _snap_to_cell_center(self, x, y):
         size = self.grid_size
@@ -301,13 +577,29 @@ class Paint(arcade.View):
         return c
 
     def on_mouse_motion(self, x, y, dx, dy):
+        if self.grid_on and (self._snap_to_cell_center(*self._to_world(x, y)) !=
+                             self._snap_to_cell_center(*self._to_world(*self.last_mouse))):
+            self.dirty.add("canvas")
         self.last_mouse = (x, y)
-        for b in self.btns_tools:
-            b.hover = b.contains(x, y)
-        for b in self.btns_actions:
-            b.hover = b.contains(x, y)
+        for b in self.btns_tools + self.btns_actions:
+            hover = b.contains(x, y)
+            if hover != b.hover:
+                b.hover = hover
+                self.dirty.add("chrome")
+
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        if y < HEIGHT - TOPBAR_H and scroll_y:
+            self._zoom_at(x, y, ZOOM_STEP ** scroll_y)
+            self.dirty.add("canvas")
 
     def on_key_press(self, symbol, modifiers):
+        self.dirty.update(("canvas", "chrome"))
+        if modifiers & arcade.key.MOD_ACCEL and symbol in (arcade.key.Z, arcade.key.Y):
+            if symbol == arcade.key.Y or modifiers & arcade.key.MOD_SHIFT:
+                self._act_redo()
+            else:
+                self._act_undo()
+            return
         if symbol in (arcade.key.KEY_1, arcade.key.NUM_1):
             self._act_pencil()
         elif symbol in (arcade.key.KEY_2, arcade.key.NUM_2):
@@ -318,6 +610,22 @@ class Paint(arcade.View):
             self._act_eraser()
         elif symbol in (arcade.key.KEY_5, arcade.key.NUM_5):
             self._act_cell()
+        elif symbol in (arcade.key.KEY_6, arcade.key.NUM_6):
+            self._act_fill()
+        elif symbol in (arcade.key.KEY_0, arcade.key.NUM_0):
+            self._act_reset_view()
+        elif symbol == arcade.key.N:
+            self._act_layer_add()
+        elif symbol in (arcade.key.PAGEUP, arcade.key.PAGEDOWN):
+            step = 1 if symbol == arcade.key.PAGEUP else -1
+            if modifiers & arcade.key.MOD_SHIFT:
+                self._act_layer_move(step)
+            else:
+                self._act_layer_select(step)
+        elif symbol == arcade.key.V:
+            self._act_layer_visible()
+        elif symbol in (arcade.key.COMMA, arcade.key.PERIOD):
+            self._act_layer_opacity(OPACITY_STEP if symbol == arcade.key.PERIOD else -OPACITY_STEP)
         elif symbol == arcade.key.A:
             self.color = arcade.color.RED
         elif symbol == arcade.key.S:
@@ -335,7 +643,22 @@ class Paint(arcade.View):
         elif symbol == arcade.key.O:
             self._act_save()
         elif symbol == arcade.key.P:
-            self._act_export_png("PaintVA.png")
+            if modifiers & arcade.key.MOD_SHIFT:
+                if modifiers & arcade.key.MOD_ACCEL:
+                    scale = EXPORT_HIRES_HIGH
+                elif modifiers & arcade.key.MOD_ALT:
+                    scale = EXPORT_HIRES_LOW
+                else:
+                    scale = EXPORT_HIRES_SCALE
+                self._act_export_png(f"PaintVA_x{scale}.png", scale)
+            else:
+                self._act_export_png("PaintVA.png")
+        elif symbol == arcade.key.J:
+            self._act_export_png("PaintVA.jpg")
+        elif symbol == arcade.key.F3:
+            PROFILER.toggle()
+        elif symbol == arcade.key.F4:
+            PROFILER.dump("perfil.csv" if modifiers & arcade.key.MOD_SHIFT else "perfil.json")
         elif symbol == arcade.key.Z:
             self.grid_size = max(GRID_MIN, self.grid_size - 2)
         elif symbol == arcade.key.X:
@@ -359,60 +682,280 @@ class Paint(arcade.View):
 
     def on_mouse_press(self, x, y, button, modifiers):
         if button == arcade.MOUSE_BUTTON_LEFT:
+            # los botones pueden cambiar el lienzo (limpiar, deshacer, papel...)
+            self.dirty.update(("canvas", "chrome"))
             if y >= HEIGHT - TOPBAR_H:
                 self._click_ui(x, y)
                 return
+            if self.loader is not None:
+                # mientras carga solo se navega y se eligen herramienta y color
+                return
+            self._commit_live()
+            if isinstance(self.tool, FillTool):
+                self._fill_at(x, y)
+                return
+            x, y = self._to_world(x, y)
             if self.grid_on and not isinstance(self.tool, EraserTool):
                 cx, cy = self._snap_to_cell_center(x, y)
                 if "CELL" not in self.used_tools:
                     self.used_tools["CELL"] = CellTool()
                 color = self._next_rainbow_color() if self.rainbow_on else self.color
-                self.traces.append({"tool": "CELL", "color": color, "trace": [(cx, cy)], "size": int(self.grid_size)})
+                self._start_trace(Trace("CELL", color, [(cx, cy)], int(self.grid_size)))
                 return
 
             if isinstance(self.tool, EraserTool):
-                self.tool.erase_at(self.traces, x, y)
-            elif isinstance(self.tool, SprayTool):
+                self._erase(x, y)
+                self.erase_from = (x, y)
+                return
+            if isinstance(self.tool, SprayTool):
                 color = self._next_rainbow_color() if self.rainbow_on else self.color
-                pts = self.tool.scatter(x, y)
-                self.traces.append({"tool": self.tool.name, "color": color, "trace": pts})
+                coverage = SprayCoverage()
+                pts = coverage.accept(self.tool.scatter(x, y, SprayTool.BURST))
+                self._start_trace(Trace(self.tool.name, color, pts))
+                self.spray = (coverage, x, y)
+                self.spray_from = (x, y)
+                self.spray_debt = 0.0
             elif isinstance(self.tool, CellTool):
                 color = self._next_rainbow_color() if self.rainbow_on else self.color
                 cx, cy = self._snap_to_cell_center(x, y)
-                self.traces.append({"tool": "CELL", "color": color, "trace": [(cx, cy)], "size": int(self.grid_size)})
+                self._start_trace(Trace("CELL", color, [(cx, cy)], int(self.grid_size)))
             else:
                 color = self._next_rainbow_color() if self.rainbow_on else self.color
-                self.traces.append({"tool": self.tool.name, "color": color, "trace": [(x, y)]})
+                self._start_trace(Trace(self.tool.name, color, [(x, y)]))
+                # la tolerancia es de 1px en pantalla, sea cual sea el zoom
+                self.simplifier.tolerance = SIMPLIFY_TOLERANCE / self.camera.zoom
+                self.simplifier.start()
+
+    def on_mouse_release(self, x, y, button, modifiers):
+        if button == arcade.MOUSE_BUTTON_LEFT:
+            self._commit_live()
+            self.erase_from = None
+            self.dirty.add("canvas")
+
+    def _fill_at(self, x, y):
+        # se rellena lo que se ve: el lienzo horneado leído de la GPU sobre el fondo,
+        # a la resolución del framebuffer; la máscara queda en coordenadas del mundo
+        with PROFILER.section("fill"):
+            self.canvas.bake(self.used_tools, self.traces, self.live, self.camera, self.index)
+            fbo = self.canvas.target.fbo
+            ratio = fbo.width / WIDTH
+            size = (fbo.width, round((HEIGHT - TOPBAR_H) * ratio))
+            data = fbo.read(viewport=(0, 0, size[0], size[1]), components=4)
+            rgba = np.frombuffer(data, np.uint8).reshape(size[1], size[0], 4)
+            color = self._next_rainbow_color() if self.rainbow_on else self.color
+            t = FillTool.fill(rgba, int(x * ratio), int(y * ratio), color, C_BG,
+                              self._to_world(0, 0), 1.0 / (self.camera.zoom * ratio))
+        if t is not None:
+            self._start_trace(t)
+            self._commit_live()
+
+    def _start_trace(self, t: Trace):
+        self.traces.append(t)
+        self.index.add_trace(t)
+        self.live = t
+
+    def _extend_live(self, pts):
+        self.live.extend(pts)
+        self.index.add_points(self.live, pts)
+
+    def _commit_live(self):
+        # lo que quedó en la cola de arrastre pertenece al trazo (o borrado) en curso;
+        # todo un arrastre del borrador, de presionar a soltar, es un solo paso de deshacer
+        self._flush_drag()
+        if self.erase_edits:
+            self.history.record_erase(self.erase_edits, self.layer)
+            self.erase_edits = []
+        if self.live is None:
+            return
+        tail = self.simplifier.finish(self.live)
+        if tail is not None:
+            self.index.add_points(self.live, [tail])
+        tool = self.used_tools.get(self.live.tool)
+        if tool is not None:
+            self.canvas.commit(tool, self.live)
+        self.journal.add(self.active, self.live)
+        self.history.record_add(len(self.traces) - 1, self.live, self.layer)
+        self.live = None
+        self.spray = None
+
+    def _erase(self, x, y):
+        with PROFILER.section("erase_at"):
+            edits = self.tool.erase_at(self.traces, x, y, index=self.index)
+        self._record_erase(edits, [(x, y)])
+
+    def _erase_along(self, start, samples):
+        with PROFILER.section("erase_at"):
+            edits = self.tool.erase_along(self.traces, start, samples, index=self.index)
+        self._record_erase(edits, [start] + samples)
+
+    def _record_erase(self, edits, path):
+        # en la textura solo se repinta la zona tocada y en la geometría retenida, solo
+        # los bloques de los trazos cambiados. El paso de deshacer se guarda al soltar
+        # (_commit_live); el journal recibe cada reemplazo enseguida
+        if edits:
+            self._repaint(self.layer, [t for _i, t, _pieces in edits],
+                          [p for _i, _t, pieces in edits for p in pieces], self._erase_area(edits, path))
+            for i, _t, pieces in edits:
+                self.journal.erase(self.active, [i])
+                for k, piece in enumerate(pieces):
+                    self.journal.insert(self.active, i + k, piece)
+            self.erase_edits += edits
+
+    @staticmethod
+    def _erase_area(edits, path):
+        # cada trazo tocado cambia solo dentro del recorrido del borrador, más el grosor
+        # de lo dibujado o el lado de una celda; un relleno se quita entero
+        reach = EraserTool.RADIUS + CHUNK_PAD
+        xs = [x for x, _ in path]
+        ys = [y for _, y in path]
+        sweep = (min(xs) - reach, min(ys) - reach, max(xs) + reach, max(ys) + reach)
+        area = [math.inf, math.inf, -math.inf, -math.inf]
+        for _i, t, _pieces in edits:
+            l, b, r, top = t.bounds()
+            pad = max(CHUNK_PAD, t.size)
+            l, b, r, top = l - pad, b - pad, r + pad, top + pad
+            if t.tool != FillTool.name:
+                l, b = max(l, sweep[0] - t.size), max(b, sweep[1] - t.size)
+                r, top = min(r, sweep[2] + t.size), min(top, sweep[3] + t.size)
+            area = [min(area[0], l), min(area[1], b), max(area[2], r), max(area[3], top)]
+        return tuple(area)
 
     def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
-        if buttons & arcade.MOUSE_BUTTON_LEFT:
-            if y >= HEIGHT - TOPBAR_H:
-                return
+        if buttons & (arcade.MOUSE_BUTTON_RIGHT | arcade.MOUSE_BUTTON_MIDDLE):
+            cx, cy = self.camera.position
+            zoom = self.camera.zoom
+            self.camera.position = (cx - dx / zoom, cy - dy / zoom)
+            self.dirty.add("canvas")
+        elif buttons & arcade.MOUSE_BUTTON_LEFT and y < HEIGHT - TOPBAR_H:
+            # un mouse de alta frecuencia manda varios eventos por frame: se encolan
+            # y on_update los procesa juntos
+            self.drag_queue.append((x, y))
+            self.dirty.add("canvas")
 
-            if self.grid_on and not isinstance(self.tool, EraserTool):
-                if self.traces:
-                    cx, cy = self._snap_to_cell_center(x, y)
-                    last = self.traces[-1]["trace"][-1]
-                    if (abs(last[0] - cx) > 1e-6) or (abs(last[1] - cy) > 1e-6):
-                        self.traces[-1]["trace"].append((cx, cy))
-                    self.traces[-1]["size"] = int(self.grid_size)
-                return
+    def _flush_drag(self):
+        if not self.drag_queue:
+            return
+        with PROFILER.section("drag"):
+            samples = [self._to_world(x, y) for (x, y) in self.drag_queue]
+            self.drag_queue.clear()
+            self._drag(samples)
 
-            if isinstance(self.tool, EraserTool):
-                self.tool.erase_at(self.traces, x, y)
-            elif isinstance(self.tool, SprayTool):
-                if self.traces:
-                    self.traces[-1]["trace"].extend(self.tool.scatter(x, y))
-            elif isinstance(self.tool, CellTool):
-                if self.traces:
-                    cx, cy = self._snap_to_cell_center(x, y)
-                    last = self.traces[-1]["trace"][-1]
-                    if (abs(last[0] - cx) > 1e-6) or (abs(last[1] - cy) > 1e-6):
-                        self.traces[-1]["trace"].append((cx, cy))
-                    self.traces[-1]["size"] = int(self.grid_size)
-            else:
-                if self.traces:
-                    self.traces[-1]["trace"].append((x, y))
+    def _drag(self, samples):
+        if isinstance(self.tool, EraserTool):
+            if self.erase_from is not None:
+                self._erase_along(self.erase_from, samples)
+                self.erase_from = samples[-1]
+        elif self.live is None:
+            return
+        elif self.live.tool == CellTool.name:
+            self._extend_cells(samples)
+        elif self.live.tool == SprayTool.name:
+            # solo mueve la boquilla; on_update emite según el tiempo presionado
+            if self.spray is not None:
+                self.spray = (self.spray[0], *samples[-1])
+        else:
+            for (x, y) in samples:
+                fixed = self.simplifier.push(self.live, x, y)
+                if fixed is not None:
+                    self.index.add_points(self.live, [fixed])
+
+    def _extend_cells(self, samples):
+        # Bresenham sobre la cuadrícula entre la última celda y cada muestra, para que
+        # un arrastre rápido no deje celdas salteadas
+        size = self.grid_size
+        self.live.size = int(size)
+        lx, ly = self.live.last()
+        i, j = int(lx // size), int(ly // size)
+        cells = []
+        for (x, y) in samples:
+            ni, nj = int(x // size), int(y // size)
+            if (ni, nj) == (i, j):
+                continue
+            path = bresenham(i, j, ni, nj)
+            next(path)
+            cells += [(ci * size + size / 2, cj * size + size / 2) for (ci, cj) in path]
+            i, j = ni, nj
+        if cells:
+            self._extend_live(cells)
+
+    def _pump_loader(self):
+        loader = self.loader
+        shown = self._load_percent()
+        start = time.perf_counter()
+        while time.perf_counter() - start < LOAD_BUDGET:
+            item = loader.next_batch()
+            # las capas llegan antes que su primera tanda
+            meta = loader.take_layers()
+            if meta is not None:
+                self.layers = [Layer(name, (), visible, opacity) for name, visible, opacity, _ in meta]
+                self.active = 0
+                self.journal.attach(self.layers)
+            if item is None:
+                break
+            li, batch = item
+            layer = self.layers[li]
+            layer.traces.extend(batch)
+            for t in batch:
+                if t.tool not in self.used_tools:
+                    self.used_tools[t.tool] = TOOL_CLASSES[t.tool]()
+            # se pinta ya, dentro del presupuesto del frame, y no todo junto en on_draw
+            layer.canvas.stream(batch)
+            layer.canvas.bake(self.used_tools, layer.traces, None, self.camera, layer.index)
+            self.dirty.add("canvas")
+        if loader.done:
+            self._finish_load()
+        elif self._load_percent() != shown:
+            self.dirty.add("chrome")
+
+    def _finish_load(self):
+        loader = self.loader
+        self.loader = None
+        if loader.error is None:
+            for layer, index in zip(self.layers, loader.indexes):
+                layer.index = index
+            print(f"Cargado: {loader.path} ({self._trace_count()} trazos, {len(self.layers)} capas)")
+        else:
+            self.layers = [Layer(DEFAULT_LAYER)]
+            self.active = 0
+            self.journal.attach(self.layers)
+            print(f"No se pudo cargar {loader.path}: {loader.error}")
+        self.journal.snapshot()
+        self.dirty.update(("canvas", "chrome"))
+
+    def _load_percent(self):
+        if self.loader is None:
+            return None
+        return int(self.loader.progress() * 100)
+
+    def on_update(self, delta_time):
+        if self.loader is not None:
+            self._pump_loader()
+        else:
+            # entre operaciones (un trazo en curso queda fuera de la foto): el journal puede compactar
+            self.journal.checkpoint(self.live)
+            if self.live is None and self.erase_from is None:
+                # después de una carga, de borrar o de cambiar el nivel de detalle: la
+                # geometría retenida se arma en los frames siguientes, una capa por vez
+                layer = next((l for l in self.layers if l.canvas.streaming or l.canvas.leveling), None)
+                if layer is not None and layer.canvas.settle(self.used_tools, layer.traces,
+                                                             time.perf_counter() + LOAD_BUDGET):
+                    self.dirty.add("canvas")
+        self._flush_drag()
+        if self.spray is None or self.live is None:
+            return
+        # como mucho 0.1 s de puntos por frame, aunque haya habido una pausa larga
+        self.spray_debt += SprayTool.RATE * min(delta_time, 0.1)
+        count = int(self.spray_debt)
+        if count == 0:
+            return
+        self.spray_debt -= count
+        coverage, x, y = self.spray
+        fx, fy = self.spray_from
+        pts = coverage.accept(SprayTool.scatter_along(fx, fy, x, y, count))
+        self.spray_from = (x, y)
+        if len(pts):
+            self._extend_live(pts)
+            self.dirty.add("canvas")
 
     # ---- dibujo ----
     def _draw_panel(self):
@@ -423,29 +966,62 @@ class Paint(arcade.View):
         cy = top - 50
         arcade.draw_circle_filled(cx, cy, 25, self.color)
         arcade.draw_circle_outline(cx, cy, 26, arcade.color.DARK_BROWN, 3)
+        layer = self.layer
+        state = f"{round(layer.opacity * 100)}%" if layer.visible else "oculta"
+        self._text("layer", f"{layer.name} ({self.active + 1}/{len(self.layers)}) {state}",
+                   cx, top - 90, 9, anchor_x="center")
 
         line_h = 15
         base_y = top - 25
         pm = {"NONE": "Sin papel", "RULED_BR": "Hoja azul/roja", "RULED_BLACK": "Hoja negra"}[self.paper_mode]
 
-        arcade.draw_text(f"Herramienta: {self.tool.name}", left + 12, base_y, arcade.color.WHITE, 13)
-        arcade.draw_text(f"Papel: {pm}  (H)", left + 12, base_y - 1 * line_h, arcade.color.WHITE, 11)
-        arcade.draw_text(f"Cuadrícula: {'ON' if self.grid_on else 'OFF'}  (G)",
-                         left + 12, base_y - 2 * line_h, arcade.color.WHITE, 11)
-        arcade.draw_text(f"Celda: {self.grid_size}px  (Z-/X+)",
-                         left + 12, base_y - 3 * line_h, arcade.color.WHITE, 11)
-        arcade.draw_text(f"Arcoíris: {'ON' if self.rainbow_on else 'OFF'}  (R)",
-                         left + 12, base_y - 4 * line_h, arcade.color.WHITE, 11)
+        self._text("tool", f"Herramienta: {self.tool.name}", left + 12, base_y, 13)
+        self._text("paper", f"Papel: {pm}  (H)", left + 12, base_y - 1 * line_h, 11)
+        self._text("grid", f"Cuadrícula: {'ON' if self.grid_on else 'OFF'}  (G)",
+                   left + 12, base_y - 2 * line_h, 11)
+        self._text("cell", f"Celda: {self.grid_size}px  (Z-/X+)",
+                   left + 12, base_y - 3 * line_h, 11)
+        self._text("rainbow", f"Arcoíris: {'ON' if self.rainbow_on else 'OFF'}  (R)",
+                   left + 12, base_y - 4 * line_h, 11)
 
         sep_y = base_y - 4 * line_h - 8
+        percent = self._load_percent()
         if self.loaded_path:
-            arcade.draw_text("Cargado:", left + 12, sep_y - 18, arcade.color.WHITE, 10)
-            arcade.draw_text(self.loaded_path[-26:], left + 12, sep_y - 34, arcade.color.WHITE, 10)
+            label = "Cargado:" if percent is None else f"Cargando... {percent}%"
+            self._text("loaded", label, left + 12, sep_y - 18, 10)
+            self._text("loaded_path", self.loaded_path[-26:], left + 12, sep_y - 34, 10)
+        if percent is not None:
+            arcade.draw_lrbt_rectangle_outline(left + 12, right - 12, bottom + 2, bottom + 8, C_PANEL_BORDER, 1)
+            arcade.draw_lrbt_rectangle_filled(left + 12, left + 12 + (right - left - 24) * percent / 100,
+                                              bottom + 2, bottom + 8, C_BTN_ACTIVE)
 
-    def _draw_ruled_paper(self):
-        if self.paper_mode == PAPER_NONE:
-            return
-        top = HEIGHT - TOPBAR_H
+    def _text(self, key, value, x, y, size, color=arcade.color.WHITE, **kwargs):
+        # los arcade.Text se crean una vez; solo se vuelve a maquetar si cambia el texto
+        text = self.texts.get(key)
+        if text is None:
+            text = arcade.Text(value, x, y, color, size, **kwargs)
+            self.texts[key] = text
+        elif text.text != value:
+            text.text = value
+        text.draw()
+
+    @staticmethod
+    def _rule_lines(view, spacing, vertical=False):
+        # líneas cada `spacing` unidades del mundo que cubren solo la vista
+        l, b, r, t = view
+        pts = []
+        y = math.floor(b / spacing) * spacing
+        while y <= t:
+            pts += [(l, y), (r, y)]
+            y += spacing
+        if vertical:
+            x = math.floor(l / spacing) * spacing
+            while x <= r:
+                pts += [(x, b), (x, t)]
+                x += spacing
+        return pts
+
+    def _build_ruled_paper(self, view):
         margin_x = 80
         if self.paper_mode == PAPER_RULED_BR:
             vcol = arcade.color.RED
@@ -453,40 +1029,112 @@ class Paint(arcade.View):
         else:
             vcol = arcade.color.BLACK
             hcol = arcade.color.BLACK
-        arcade.draw_line(margin_x, 0, margin_x, top, vcol, 2)
-        y = 0
-        while y <= top:
-            arcade.draw_line(0, y, WIDTH, y, hcol, 1)
-            y += RULE_SPACING
+        shapes = ShapeElementList()
+        # muy alejado, el rayado sería una mancha: se deja solo el margen
+        if RULE_SPACING * self.camera.zoom >= MIN_LINE_GAP:
+            shapes.append(create_lines(self._rule_lines(view, RULE_SPACING), hcol))
+        shapes.append(create_line(margin_x, view[1], margin_x, view[3], vcol, 2))
+        return shapes
+
+    def _draw_ruled_paper(self, view):
+        if self.paper_mode == PAPER_NONE:
+            return
+        # el fondo solo se reconstruye cuando cambia el modo de papel (H) o la vista
+        key = (self.paper_mode, view)
+        if self.paper_key != key:
+            self.paper_shapes = self._build_ruled_paper(view)
+            self.paper_key = key
+        self.paper_shapes.draw()
 
-    def _draw_grid(self):
+    def _build_grid(self, view):
+        shapes = ShapeElementList()
+        if self.grid_size * self.camera.zoom >= MIN_LINE_GAP:
+            shapes.append(create_lines(self._rule_lines(view, self.grid_size, True), C_GRID))
+        return shapes
+
+    def _draw_grid(self, view):
         if not self.grid_on:
             return
         size = self.grid_size
-        top = HEIGHT - TOPBAR_H
-        x = 0
-        while x <= WIDTH:
-            arcade.draw_line(x, 0, x, top, C_GRID, 1)
-            x += size
-        y = 0
-        while y <= top:
-            arcade.draw_line(0, y, WIDTH, y, C_GRID, 1)
-            y += size
-        mx, my = self.last_mouse
-        if my < top:
-            cx = int(mx // size) * size + size / 2
-            cy = int(my // size) * size + size / 2
+        # la cuadrícula solo se reconstruye cuando cambia el tamaño (Z/X) o la vista
+        key = (size, view)
+        if self.grid_key != key:
+            self.grid_shapes = self._build_grid(view)
+            self.grid_key = key
+        self.grid_shapes.draw()
+        if self.last_mouse[1] < HEIGHT - TOPBAR_H:
+            cx, cy = self._snap_to_cell_center(*self._to_world(*self.last_mouse))
             half = size / 2
             arcade.draw_lrbt_rectangle_outline(cx - half, cx + half, cy - half, cy + half, arcade.color.GOLD, 1)
 
     def on_draw(self):
+        with PROFILER.section("on_draw"):
+            self._present()
+        if PROFILER.enabled:
+            PROFILER.install_draw_counter()
+            PROFILER.count("traces", self._trace_count())
+            if PROFILER.frame % REFRESH_FRAMES == 0:
+                PROFILER.count("points", sum(len(t) for l in self.layers for t in l.traces))
+            PROFILER.draw_overlay(PAD, HEIGHT - TOPBAR_H - 16)
+            PROFILER.end_frame()
+
+    def _present(self):
+        if self.frame.ensure() or not ON_DEMAND_RENDER:
+            self.dirty.update(("canvas", "chrome"))
+        if self.dirty:
+            with self.frame.activate():
+                if "canvas" in self.dirty:
+                    self._draw_frame()
+                else:
+                    # la interfaz es opaca: basta con pintarla encima del frame anterior
+                    self._draw_chrome_layer()
+            self.dirty.clear()
         self.clear()
+        self.frame.draw()
 
-        self._draw_ruled_paper()
-        for tool in self.used_tools.values():
-            tool.draw_traces(self.traces)
-        self._draw_grid()
+    def _draw_frame(self):
+        self.frame.fbo.clear(color=self.background_color)
 
+        view = view_of(self.camera)
+        with PROFILER.section("paper"), self.camera.activate():
+            self._draw_ruled_paper(view)
+        # cada capa visible pega su textura, de abajo hacia arriba; el trazo en curso
+        # va justo encima de la capa activa
+        for layer in self.layers:
+            if not layer.visible:
+                continue
+            live = self.live if layer is self.layer else None
+            with PROFILER.section("canvas"):
+                layer.canvas.draw(self.used_tools, layer.traces, live, self.camera, layer.opacity, layer.index)
+            if live is not None:
+                with PROFILER.section("live:" + live.tool), self.camera.activate():
+                    self.used_tools[live.tool].draw_traces([live], view)
+        with self.camera.activate():
+            with PROFILER.section("grid"):
+                self._draw_grid(view)
+
+        self._draw_chrome_layer()
+
+    def _draw_chrome_layer(self):
+        # la interfaz se redibuja en su textura solo cuando cambia algo visible
+        with PROFILER.section("chrome"):
+            key = self._chrome_state()
+            if self.chrome.ensure() or key != self.chrome_key:
+                with self.chrome.activate():
+                    self.chrome.clear()
+                    self._draw_chrome()
+                self.chrome_key = key
+            self.chrome.draw()
+
+    def _chrome_state(self):
+        return (
+            self.tool.name, tuple(self.color), self.paper_mode, self.grid_on, self.grid_size,
+            self.rainbow_on, self.loaded_path, self._load_percent(),
+            self.active, len(self.layers), self.layer.visible, self.layer.opacity,
+            tuple(b.hover for b in self.btns_tools), tuple(b.hover for b in self.btns_actions),
+        )
+
+    def _draw_chrome(self):
         top1_bottom = HEIGHT - ROW1_H
         arcade.draw_lrbt_rectangle_filled(0, WIDTH, top1_bottom, HEIGHT, C_TOP1)
         arcade.draw_lrbt_rectangle_filled(0, WIDTH, HEIGHT - TOPBAR_H, top1_bottom, C_TOP2)
@@ -518,12 +1166,7 @@ class Paint(arcade.View):
             arcade.draw_circle_outline(sx, sy, r + 1, border, 1)
 
         arcade.draw_lrbt_rectangle_filled(0, WIDTH, 0, 22, arcade.color.LIGHT_GRAY)
-        arcade.draw_text(
-            self.help_text,
-            WIDTH / 2, 6,
-            C_HELP, 10,
-            anchor_x="center"
-        )
+        self._text("help", self.help_text, WIDTH / 2, 6, 10, C_HELP, anchor_x="center")
 
 
 def main():
@@ -534,6 +1177,9 @@ def main():
         app = Paint()
     window.show_view(app)
     arcade.run()
+    if app.exporter is not None:
+        app.exporter.shutdown(wait=True)
+    app.journal.close()
 
 
 if __name__ == "__main__":
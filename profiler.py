@@ -0,0 +1,146 @@
+import csv
+import json
+import os
+import time
+from collections import deque
+import arcade
+
+# Instrumentación opcional: F3 o PAINTVA_PROFILE=1 la activa, F4 vuelca a JSON
+# (Shift+F4 a CSV). Apagada, section() devuelve un contexto vacío compartido.
+WINDOW = 300
+MAX_ROWS = 10000
+REFRESH_FRAMES = 15
+
+
+class _Section:
+    __slots__ = ("prof", "name", "start")
+
+    def __init__(self, prof, name):
+        self.prof = prof
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.prof.add(self.name, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+class _NullSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSection()
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FrameProfiler:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.samples = {}
+        self.counters = {}
+        self.current = {}
+        self.rows = deque(maxlen=MAX_ROWS)
+        self.frame = 0
+        self.draw_calls = 0
+        self.texts = []
+        self.patched = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.install_draw_counter()
+
+    def install_draw_counter(self):
+        # cuenta cada Geometry.render de arcade (figuras, sprites, shape lists, texturas)
+        if self.patched or not self.enabled:
+            return
+        ctx = arcade.get_window().ctx
+        cls = type(ctx.generic_draw_line_strip_geometry)
+        render = cls.render
+        prof = self
+
+        def counted_render(geometry, *args, **kwargs):
+            if prof.enabled:
+                prof.draw_calls += 1
+            return render(geometry, *args, **kwargs)
+
+        cls.render = counted_render
+        self.patched = True
+
+    def section(self, name: str):
+        return _Section(self, name) if self.enabled else _NULL
+
+    def add(self, name: str, ms: float):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = deque(maxlen=WINDOW)
+            self.samples[name] = samples
+        samples.append(ms)
+        self.current[name] = self.current.get(name, 0.0) + ms
+
+    def count(self, name: str, value: int):
+        if self.enabled:
+            self.counters[name] = value
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.frame += 1
+        self.counters["draw_calls"] = self.draw_calls
+        row = {"frame": self.frame}
+        row.update(self.current)
+        row.update(self.counters)
+        self.rows.append(row)
+        self.current = {}
+        self.draw_calls = 0
+
+    def stats(self) -> dict:
+        return {name: (_percentile(s, 0.5), _percentile(s, 0.99)) for name, s in self.samples.items() if s}
+
+    def draw_overlay(self, x: float, y: float):
+        if not self.enabled:
+            return
+        if self.frame % REFRESH_FRAMES == 0 or not self.texts:
+            lines = [f"{name:<18} p50 {p50:6.2f}  p99 {p99:6.2f} ms"
+                     for name, (p50, p99) in sorted(self.stats().items())]
+            lines += [f"{name:<18} {value}" for name, value in sorted(self.counters.items())]
+            while len(self.texts) < len(lines):
+                self.texts.append(arcade.Text("", x, y - 14 * len(self.texts), arcade.color.BLACK, 9,
+                                              font_name=("Courier New", "DejaVu Sans Mono", "monospace")))
+            for text, line in zip(self.texts, lines):
+                if text.text != line:
+                    text.text = line
+        height = 14 * len(self.texts) + 6
+        arcade.draw_lrbt_rectangle_filled(x - 4, x + 330, y - height + 12, y + 14, (255, 255, 255, 210))
+        for text in self.texts:
+            text.draw()
+
+    def dump(self, path: str):
+        rows = list(self.rows)
+        if path.endswith(".csv"):
+            fields = []
+            for row in rows:
+                fields += [k for k in row if k not in fields]
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            summary = {name: {"p50": p50, "p99": p99} for name, (p50, p99) in self.stats().items()}
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"summary": summary, "frames": rows}, f, indent=1)
+        print(f"Perfil guardado en {path} ({len(rows)} frames)")
+
+
+PROFILER = FrameProfiler(os.environ.get("PAINTVA_PROFILE", "") not in ("", "0"))
@@ -0,0 +1,129 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageDraw
+import storage
+from main import WIDTH, HEIGHT, TOPBAR_H, GRID_DEFAULT, TOOL_CLASSES
+
+# Render sin ventana: mismas reglas que draw_traces de cada herramienta, pero
+# dibujadas en CPU con PIL, así se puede correr en paralelo en varios procesos.
+#   python -m render dibujos/*.pva --out miniaturas -j 8
+CANVAS_W = WIDTH
+CANVAS_H = HEIGHT - TOPBAR_H
+TOOLS = {name: cls() for name, cls in TOOL_CLASSES.items()}
+RASTER_PAD = 5.0  # medio grosor del marcador: lo que puede salirse de la caja de un trazo
+
+
+def _draw_traces(draw, traces, scale, left, top, size, offset=(0, 0)):
+    ox, oy = offset
+    view = (left + ox / scale, top - (oy + size[1]) / scale, left + (ox + size[0]) / scale, top - oy / scale)
+    for t in traces:
+        tool = TOOLS.get(t.tool)
+        if tool is not None and t.intersects(view, max(RASTER_PAD, t.size / 2)):
+            tool.rasterize(draw, t, scale, left, top, ox, oy)
+
+
+def render_traces(traces, scale: float = 1.0, left: float = 0.0, top: float = CANVAS_H,
+                  size: tuple[int, int] = None, background=(255, 255, 255)) -> Image.Image:
+    if size is None:
+        size = (round(CANVAS_W * scale), round(CANVAS_H * scale))
+    img = Image.new("RGB", size, background)
+    _draw_traces(ImageDraw.Draw(img), traces, scale, left, top, size)
+    return img
+
+
+def render_layers(layers, scale: float = 1.0, left: float = 0.0, top: float = CANVAS_H,
+                  size: tuple[int, int] = None, background=(255, 255, 255),
+                  offset: tuple[int, int] = (0, 0)) -> Image.Image:
+    # layers = [(nombre, visible, opacidad, trazos)] de abajo hacia arriba, como en storage.
+    # Las capas opacas se dibujan directo sobre el resultado; las translúcidas, aparte
+    # sobre transparente y después se componen con su opacidad. offset es el píxel de la
+    # imagen con origen (left, top) donde empieza esta (para mosaicos)
+    if size is None:
+        size = (round(CANVAS_W * scale), round(CANVAS_H * scale))
+    img = Image.new("RGBA", size, tuple(background) + (255,))
+    for _name, visible, opacity, traces in layers:
+        if not visible:
+            continue
+        if opacity >= 1.0:
+            _draw_traces(ImageDraw.Draw(img), traces, scale, left, top, size, offset)
+            continue
+        part = Image.new("RGBA", size, (0, 0, 0, 0))
+        _draw_traces(ImageDraw.Draw(part), traces, scale, left, top, size, offset)
+        part.putalpha(part.getchannel("A").point(lambda a: round(a * opacity)))
+        img.alpha_composite(part)
+    return img.convert("RGB")
+
+
+def render_tiled(layers, scale: float, tile: int = 1024, background=(255, 255, 255),
+                 region: tuple = None) -> Image.Image:
+    # lienzo grande armado por mosaicos de `tile` px, nunca un buffer de dibujo enorme.
+    # region = (izq, abajo, der, arriba) en coordenadas del mundo; por defecto la hoja inicial
+    left, bottom, right, top = region if region is not None else (0.0, 0.0, CANVAS_W, CANVAS_H)
+    width = round((right - left) * scale)
+    height = round((top - bottom) * scale)
+    out = Image.new("RGB", (width, height), background)
+    pad = 32
+    for ty in range(0, height, tile):
+        for tx in range(0, width, tile):
+            w = min(tile, width - tx)
+            h = min(tile, height - ty)
+            # se dibuja con un margen para que las figuras del borde se corten igual en ambos
+            # mosaicos; el origen del mosaico va en píxeles enteros, no en coordenadas del mundo
+            part = render_layers(layers, scale, left, top, (w + 2 * pad, h + 2 * pad), background,
+                                 (tx - pad, ty - pad))
+            out.paste(part.crop((pad, pad, pad + w, pad + h)), (tx, ty))
+    return out
+
+
+def render_file(path: str, out_dir: str, scale: float = 1.0, thumb: int = 0) -> str:
+    img = render_layers(storage.load_layers(path, GRID_DEFAULT), scale)
+    if thumb:
+        img.thumbnail((thumb, thumb))
+    name = os.path.splitext(os.path.basename(path))[0] + ".png"
+    out = os.path.join(out_dir, name)
+    img.save(out)
+    return out
+
+
+def _render_job(job):
+    path, out_dir, scale, thumb = job
+    try:
+        return path, render_file(path, out_dir, scale, thumb), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Renderiza dibujos .pva/.txt a PNG sin abrir la ventana.")
+    parser.add_argument("inputs", nargs="+", help="archivos o patrones (dibujos/*.pva)")
+    parser.add_argument("--out", default="render_out", help="carpeta de salida")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="procesos en paralelo")
+    parser.add_argument("--scale", type=float, default=1.0, help="escala del lienzo")
+    parser.add_argument("--thumb", type=int, default=0, help="lado máximo de la miniatura en px (0 = sin reducir)")
+    args = parser.parse_args()
+
+    paths = []
+    for pattern in args.inputs:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    os.makedirs(args.out, exist_ok=True)
+    jobs = [(p, args.out, args.scale, args.thumb) for p in paths]
+
+    start = time.perf_counter()
+    done = failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for path, out, err in pool.map(_render_job, jobs, chunksize=max(1, len(jobs) // (4 * max(1, args.jobs)))):
+            if err is None:
+                done += 1
+            else:
+                failed += 1
+                print(f"No se pudo renderizar {path}: {err}")
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"{done} archivos en {elapsed:.2f}s ({rate:.1f} archivos/s), {failed} con error")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import math
+import numpy as np
+from array import array
+from tool import Trace, PencilTool, MarkerTool, FillTool
+
+STROKES = (PencilTool.name, MarkerTool.name)
+
+
+class SpatialIndex:
+    # rejilla uniforme: celda -> {id(trazo): array("f", [x0, y0, x1, y1, ...])}.
+    # En lápiz y marcador los puntos llegan en orden y se agregan muestras intermedias
+    # cada STEP px, así que un segmento largo también aparece en las celdas que cruza
+    STEP = 8.0
+
+    def __init__(self, cell: float = 32.0):
+        self.cell = cell
+        self.cells = {}
+        self.owners = {}
+        self.tails = {}  # id(trazo de línea) -> último punto agregado
+        self.fills = {}  # id(relleno) -> relleno: sus muestras pueden quedar más separadas que una celda
+
+    def clear(self):
+        self.cells.clear()
+        self.owners.clear()
+        self.tails.clear()
+        self.fills.clear()
+
+    def rebuild(self, traces: list[Trace]):
+        self.clear()
+        for t in traces:
+            self.add_trace(t)
+
+    def add_trace(self, t: Trace):
+        # el trazo entero de una vez (al cargar, deshacer o partir con el borrador): las
+        # muestras y sus celdas se calculan con numpy y se agregan de a una celda
+        if t.tool == FillTool.name:
+            self.fills[id(t)] = t
+            xy = np.asarray(FillTool.samples(t), np.float64).reshape(-1, 2)
+        else:
+            xy = np.frombuffer(t.coords, np.float32).reshape(-1, 2).astype(np.float64)
+        tid = id(t)
+        if t.tool in STROKES and len(xy):
+            self.tails[tid] = (float(xy[-1, 0]), float(xy[-1, 1]))
+            if len(xy) > 1:
+                a = xy[:-1]
+                d = xy[1:] - a
+                n = np.maximum(1, np.ceil(np.hypot(d[:, 0], d[:, 1]) / self.STEP)).astype(np.int64)
+                seg = np.repeat(np.arange(len(n)), n)
+                k = np.arange(1, n.sum() + 1) - np.repeat(np.cumsum(n) - n, n)
+                xy = np.concatenate([xy[:1], a[seg] + d[seg] * (k / n[seg])[:, None]])
+        entry = self.owners.get(tid)
+        if entry is None:
+            entry = (t, set())
+            self.owners[tid] = entry
+        if not len(xy):
+            return
+        keys = entry[1]
+        cells = np.floor(xy / self.cell).astype(np.int64)
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        cells = cells[order]
+        pts = xy[order].astype(np.float32)
+        starts = np.flatnonzero(np.any(cells[1:] != cells[:-1], axis=1)) + 1
+        for lo, hi in zip(np.concatenate([[0], starts]).tolist(), np.concatenate([starts, [len(pts)]]).tolist()):
+            key = (int(cells[lo, 0]), int(cells[lo, 1]))
+            bucket = self.cells.get(key)
+            if bucket is None:
+                bucket = {}
+                self.cells[key] = bucket
+            coords = bucket.get(tid)
+            if coords is None:
+                coords = array("f")
+                bucket[tid] = coords
+                keys.add(key)
+            coords.frombytes(pts[lo:hi].tobytes())
+
+    def add_points(self, t: Trace, pts):
+        tid = id(t)
+        entry = self.owners.get(tid)
+        if entry is None:
+            entry = (t, set())
+            self.owners[tid] = entry
+        keys = entry[1]
+        if t.tool in STROKES:
+            pts = self._densify(tid, pts)
+        size = self.cell
+        for (x, y) in pts:
+            key = (int(x // size), int(y // size))
+            bucket = self.cells.get(key)
+            if bucket is None:
+                bucket = {}
+                self.cells[key] = bucket
+            coords = bucket.get(tid)
+            if coords is None:
+                coords = array("f")
+                bucket[tid] = coords
+                keys.add(key)
+            coords.append(x)
+            coords.append(y)
+
+    def _densify(self, tid: int, pts):
+        step = self.STEP
+        tail = self.tails.get(tid)
+        for (x, y) in pts:
+            if tail is not None:
+                px, py = tail
+                n = math.ceil(math.hypot(x - px, y - py) / step)
+                for k in range(1, n):
+                    yield px + (x - px) * k / n, py + (y - py) * k / n
+            yield x, y
+            tail = (x, y)
+            self.tails[tid] = tail
+
+    def remove(self, t: Trace):
+        self.tails.pop(id(t), None)
+        self.fills.pop(id(t), None)
+        entry = self.owners.pop(id(t), None)
+        if entry is None:
+            return
+        for key in entry[1]:
+            bucket = self.cells[key]
+            del bucket[id(t)]
+            if not bucket:
+                del self.cells[key]
+
+    def hits(self, x: float, y: float, radius: float) -> list[Trace]:
+        size = self.cell
+        r2 = radius * radius
+        found = {}
+        for i in range(int((x - radius) // size), int((x + radius) // size) + 1):
+            for j in range(int((y - radius) // size), int((y + radius) // size) + 1):
+                bucket = self.cells.get((i, j))
+                if not bucket:
+                    continue
+                for tid, coords in bucket.items():
+                    if tid in found:
+                        continue
+                    for k in range(0, len(coords), 2):
+                        dx = coords[k] - x
+                        dy = coords[k + 1] - y
+                        if dx * dx + dy * dy <= r2:
+                            found[tid] = self.owners[tid][0]
+                            break
+        return list(found.values())
+
+    def query(self, area, pad: float = 0.0) -> list[Trace]:
+        # trazos con alguna muestra en las celdas que cubren `area` (izq, abajo, der,
+        # arriba) agrandada en `pad`, más los rellenos cuya caja la toca; sin orden
+        size = self.cell
+        l, b, r, top = area
+        i0, i1 = int((l - pad) // size), int((r + pad) // size)
+        j0, j1 = int((b - pad) // size), int((top + pad) // size)
+        found = {}
+        if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(self.cells):
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    bucket = self.cells.get((i, j))
+                    if bucket:
+                        found.update(dict.fromkeys(bucket))
+        else:
+            # un área más grande que todo lo dibujado: se recorren las celdas ocupadas
+            for (i, j), bucket in self.cells.items():
+                if i0 <= i <= i1 and j0 <= j <= j1:
+                    found.update(dict.fromkeys(bucket))
+        for tid, t in self.fills.items():
+            if t.intersects(area, pad):
+                found[tid] = None
+        return [self.owners[tid][0] for tid in found]
@@ -0,0 +1,271 @@
+import ast
+import mmap
+import os
+import struct
+import sys
+import threading
+import weakref
+from array import array
+from tool import Trace
+
+# Formato binario .pva (little endian):
+#   cabecera  MAGIC, versión, flags, cantidad de trazos
+#   capas     (versión 2) cantidad de capas y un registro por capa, de abajo hacia
+#             arriba (visible, opacidad, cantidad de trazos, nombre en utf-8)
+#   tabla     un registro fijo por trazo (herramienta, codificación, color, tamaño, puntos, bytes, offset),
+#             primero los de la capa de abajo
+#   datos     coordenadas de cada trazo, alineadas a 4 bytes
+# ENC_F32 guarda float32 crudos y se lee sin copiar desde mmap;
+# ENC_DELTA guarda deltas cuantizados a 1/QUANT px como varints zigzag.
+# Un archivo de versión 1 (sin capas) se lee como una sola capa.
+MAGIC = b"PVA\x00"
+VERSION = 2
+HEADER = struct.Struct("<4sHHI")
+LAYER_COUNT = struct.Struct("<I")
+LAYER = struct.Struct("<?3xfI32s")
+RECORD = struct.Struct("<BB4BH2xIIQ")
+DEFAULT_LAYER = "Capa 1"
+ENC_F32 = 0
+ENC_DELTA = 1
+QUANT = 64.0
+
+TOOL_CODES = {"PENCIL": 1, "MARKER": 2, "SPRAY": 3, "CELL": 4, "FILL": 5}
+TOOL_NAMES = {code: name for name, code in TOOL_CODES.items()}
+
+# archivo -> [(mmap, trazos cuyas coordenadas apuntan a él)], todo con referencias débiles
+_MAPPED = {}
+_MAPPED_LOCK = threading.Lock()
+
+
+def _map_key(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _release(path: str):
+    # antes de reemplazar `path`: los trazos que todavía leen del mmap de ese archivo
+    # pasan a tener su propia copia y el mapeo se cierra (en Windows no se puede
+    # reemplazar un archivo que sigue mapeado)
+    with _MAPPED_LOCK:
+        maps = _MAPPED.pop(_map_key(path), [])
+    for mm_ref, traces in maps:
+        mm = mm_ref()
+        if mm is None:
+            continue
+        for t in list(traces):
+            coords = t.coords
+            if isinstance(coords, memoryview) and coords.obj is mm:
+                t.coords = array("f", coords)
+        try:
+            mm.close()
+        except BufferError:
+            # alguien todavía tiene una vista (p. ej. un arreglo de numpy en uso); el
+            # mapeo se libera cuando la suelte
+            pass
+
+
+def _encode_deltas(coords) -> bytes:
+    out = bytearray()
+    px = py = 0
+    it = iter(coords)
+    for x, y in zip(it, it):
+        qx = round(x * QUANT)
+        qy = round(y * QUANT)
+        for d in (qx - px, qy - py):
+            z = d << 1 if d >= 0 else ((-d) << 1) - 1
+            while z >= 0x80:
+                out.append((z & 0x7F) | 0x80)
+                z >>= 7
+            out.append(z)
+        px, py = qx, qy
+    return bytes(out)
+
+
+def _decode_deltas(buf) -> array:
+    out = array("f")
+    ax = ay = 0
+    z = shift = 0
+    even = True
+    for b in buf:
+        z |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        d = (z >> 1) ^ -(z & 1)
+        if even:
+            ax += d
+            out.append(ax / QUANT)
+        else:
+            ay += d
+            out.append(ay / QUANT)
+        even = not even
+        z = shift = 0
+    return out
+
+
+def _encoding_for(t: Trace, encoding: int) -> int:
+    # el relleno guarda su cabecera (origen, lado del píxel) y corridas enteras que
+    # los deltas cuantizados no conservan exactas: siempre va en float32
+    return ENC_F32 if t.tool == "FILL" else encoding
+
+
+def _encode(t: Trace, encoding: int) -> bytes:
+    if encoding == ENC_DELTA:
+        return _encode_deltas(t.coords)
+    coords = t.coords if isinstance(t.coords, array) else array("f", t.coords)
+    if sys.byteorder != "little":
+        coords = array("f", coords)
+        coords.byteswap()
+    return coords.tobytes()
+
+
+def pack_trace(t: Trace, encoding: int = ENC_F32) -> bytes:
+    # registro autocontenido (offset 0), usado por el journal
+    encoding = _encoding_for(t, encoding)
+    blob = _encode(t, encoding)
+    r, g, b, a = (tuple(t.color) + (255,))[:4]
+    return RECORD.pack(TOOL_CODES[t.tool], encoding, r, g, b, a, t.size, len(t), len(blob), 0) + blob
+
+
+def unpack_trace(buf) -> Trace:
+    code, encoding, r, g, b, a, size, _npts, nbytes, _offset = RECORD.unpack_from(buf, 0)
+    data = bytes(buf[RECORD.size:RECORD.size + nbytes])
+    if encoding == ENC_DELTA:
+        coords = _decode_deltas(data)
+    else:
+        coords = array("f", data)
+        if sys.byteorder != "little":
+            coords.byteswap()
+    return Trace.from_coords(TOOL_NAMES[code], (r, g, b, a), coords, size)
+
+
+def save_layers(path: str, layers, encoding: int = ENC_DELTA):
+    # layers: [(nombre, visible, opacidad, trazos)] de abajo hacia arriba
+    layers = [(name, visible, opacity, [t for t in traces if t.tool in TOOL_CODES])
+              for name, visible, opacity, traces in layers]
+    traces = [t for *_, kept in layers for t in kept]
+    encodings = [_encoding_for(t, encoding) for t in traces]
+    blobs = [_encode(t, enc) for t, enc in zip(traces, encodings)]
+    table = bytearray(LAYER_COUNT.pack(len(layers)))
+    for name, visible, opacity, kept in layers:
+        table += LAYER.pack(bool(visible), opacity, len(kept), name.encode("utf-8")[:32])
+    offset = HEADER.size + len(table) + RECORD.size * len(traces)
+    for t, enc, blob in zip(traces, encodings, blobs):
+        offset = (offset + 3) & ~3
+        r, g, b, a = (tuple(t.color) + (255,))[:4]
+        table += RECORD.pack(TOOL_CODES[t.tool], enc, r, g, b, a, t.size, len(t), len(blob), offset)
+        offset += len(blob)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(traces)))
+        f.write(table)
+        for blob in blobs:
+            f.write(b"\x00" * (-f.tell() % 4))
+            f.write(blob)
+    _release(path)
+    os.replace(tmp, path)
+
+
+def save(path: str, traces: list[Trace], encoding: int = ENC_DELTA):
+    save_layers(path, [(DEFAULT_LAYER, True, 1.0, traces)], encoding)
+
+
+def is_binary(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _open(path: str):
+    # devuelve la vista sobre el archivo, las capas y dónde empieza la tabla de trazos
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    magic, version, _flags, count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC or version > VERSION:
+        raise ValueError(f"formato no soportado: {path}")
+    pos = HEADER.size
+    if version < 2:
+        return view, [(DEFAULT_LAYER, True, 1.0, count)], pos
+    (n,) = LAYER_COUNT.unpack_from(view, pos)
+    pos += LAYER_COUNT.size
+    layers = []
+    for _ in range(n):
+        visible, opacity, size, name = LAYER.unpack_from(view, pos)
+        pos += LAYER.size
+        # la opacidad va en float32: se redondea para que 0.9 vuelva como 0.9
+        layers.append((name.rstrip(b"\x00").decode("utf-8", "ignore"), visible, round(opacity, 4), size))
+    return view, layers, pos
+
+
+def read_layers(path: str) -> list[tuple[str, bool, float, int]]:
+    # (nombre, visible, opacidad, cantidad de trazos) de cada capa, sin leer los trazos
+    view, layers, _pos = _open(path)
+    view.release()
+    return layers
+
+
+def iter_traces(path: str):
+    # todos los trazos, capa por capa desde la de abajo (ver read_layers);
+    # el mmap queda vivo mientras algún trazo apunte a sus coordenadas, o hasta
+    # que se vuelva a guardar sobre el mismo archivo (_release)
+    view, layers, pos = _open(path)
+    mapped = weakref.WeakSet()
+    with _MAPPED_LOCK:
+        maps = _MAPPED.setdefault(_map_key(path), [])
+        maps[:] = [(ref, traces) for ref, traces in maps if ref() is not None]
+        maps.append((weakref.ref(view.obj), mapped))
+    try:
+        for _ in range(sum(layer[3] for layer in layers)):
+            code, encoding, r, g, b, a, size, npts, nbytes, offset = RECORD.unpack_from(view, pos)
+            pos += RECORD.size
+            data = view[offset:offset + nbytes]
+            if encoding == ENC_DELTA:
+                coords = _decode_deltas(data)
+            elif sys.byteorder == "little":
+                coords = data.cast("f")
+            else:
+                coords = array("f", data.tobytes())
+                coords.byteswap()
+            t = Trace.from_coords(TOOL_NAMES[code], (r, g, b, a), coords, size)
+            if isinstance(coords, memoryview):
+                mapped.add(t)
+            yield t
+    finally:
+        view.release()
+
+
+def load_legacy_txt(path: str, default_size: int = 16) -> list[Trace]:
+    with open(path, "r", encoding="utf-8") as f:
+        loaded = ast.literal_eval(f.read().strip())
+    if not isinstance(loaded, list):
+        raise ValueError("archivo inválido (se esperaba lista)")
+    return [Trace.from_dict(t, default_size) for t in loaded]
+
+
+def load_layers(path: str, default_size: int = 16) -> list[tuple[str, bool, float, list[Trace]]]:
+    if not is_binary(path):
+        return [(DEFAULT_LAYER, True, 1.0, load_legacy_txt(path, default_size))]
+    traces = iter_traces(path)
+    return [(name, visible, opacity, [next(traces) for _ in range(count)])
+            for name, visible, opacity, count in read_layers(path)]
+
+
+def load(path: str, default_size: int = 16) -> list[Trace]:
+    # todas las capas en una sola lista, de abajo hacia arriba
+    if is_binary(path):
+        return list(iter_traces(path))
+    return load_legacy_txt(path, default_size)
+
+
+def main():
+    # conversor: python storage.py dibujo.txt dibujo.pva
+    if len(sys.argv) != 3:
+        print("Uso: python storage.py <entrada.txt|.pva> <salida.pva>")
+        return
+    layers = load_layers(sys.argv[1])
+    save_layers(sys.argv[2], layers)
+    count = sum(len(layer[3]) for layer in layers)
+    print(f"Convertido {sys.argv[1]} -> {sys.argv[2]} ({count} trazos en {len(layers)} capas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+from bisect import bisect_left
+from tool import Trace
+
+GAP = 1 << 16  # separación entre claves de orden consecutivas al numerar
+
+
+class TraceStore:
+    # Lista ordenada de trazos (el orden es el orden de dibujo) con dos vistas
+    # derivadas que se mantienen al agregar al final y se recalculan, una sola vez
+    # y solo si alguien las pide, después de insertar o borrar en el medio:
+    #   buckets  herramienta -> sus trazos, en orden
+    #   runs     corridas (herramienta, color, inicio, fin) de trazos consecutivos iguales
+    # Cada trazo tiene además una clave de orden creciente (keys, paralela a items), así
+    # la posición de un trazo sale de una búsqueda binaria y no de recorrer la lista
+    def __init__(self, traces=()):
+        self.items = list(traces)
+        self._buckets = None
+        self._runs = None
+        self._renumber()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __delitem__(self, i: int):
+        t = self.items.pop(i)
+        del self._keys[i]
+        del self._key_of[id(t)]
+        self._invalidate()
+
+    def index(self, t: Trace) -> int:
+        key = self._key_of.get(id(t))
+        if key is not None:
+            i = bisect_left(self._keys, key)
+            if i < len(self.items) and self.items[i] is t:
+                return i
+        raise ValueError("el trazo no está en el store")
+
+    def _invalidate(self):
+        self._buckets = None
+        self._runs = None
+
+    def _renumber(self):
+        # claves 0, GAP, 2·GAP...: deja lugar para muchas inserciones entre dos trazos
+        self._keys = list(range(0, len(self.items) * GAP, GAP))
+        self._key_of = {id(t): k for t, k in zip(self.items, self._keys)}
+
+    def append(self, t: Trace):
+        key = self._keys[-1] + GAP if self._keys else 0
+        self.items.append(t)
+        self._keys.append(key)
+        self._key_of[id(t)] = key
+        if self._buckets is not None:
+            self._buckets.setdefault(t.tool, []).append(t)
+        if self._runs is not None:
+            self._extend_runs(len(self.items) - 1, t)
+
+    def extend(self, traces):
+        for t in traces:
+            self.append(t)
+
+    def insert(self, i: int, t: Trace):
+        if i >= len(self.items):
+            self.append(t)
+            return
+        i = max(0, i)
+        lo = self._keys[i - 1] if i > 0 else self._keys[0] - 2 * GAP
+        hi = self._keys[i]
+        if hi - lo < 2:
+            # no queda lugar entre los vecinos: se vuelve a numerar todo (poco frecuente)
+            self._renumber()
+            lo = self._keys[i - 1] if i > 0 else -2 * GAP
+            hi = self._keys[i]
+        key = (lo + hi) // 2
+        self.items.insert(i, t)
+        self._keys.insert(i, key)
+        self._key_of[id(t)] = key
+        self._invalidate()
+
+    def clear(self):
+        self.items.clear()
+        self._keys.clear()
+        self._key_of.clear()
+        self._invalidate()
+
+    def _extend_runs(self, i: int, t: Trace):
+        runs = self._runs
+        if runs and runs[-1][0] == t.tool and runs[-1][1] == t.color and runs[-1][3] == i:
+            tool, color, start, _ = runs[-1]
+            runs[-1] = (tool, color, start, i + 1)
+        else:
+            runs.append((t.tool, t.color, i, i + 1))
+
+    def bucket(self, tool: str) -> list[Trace]:
+        if self._buckets is None:
+            self._buckets = {}
+            for t in self.items:
+                self._buckets.setdefault(t.tool, []).append(t)
+        return self._buckets.get(tool, [])
+
+    def tools(self) -> list[str]:
+        self.bucket("")
+        return [name for name, bucket in self._buckets.items() if bucket]
+
+    def runs(self) -> list[tuple[str, tuple, int, int]]:
+        if self._runs is None:
+            self._runs = []
+            for i, t in enumerate(self.items):
+                self._extend_runs(i, t)
+        return self._runs
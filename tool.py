@@ -1,84 +1,671 @@
 import arcade
 import math
-import random
+import numpy as np
+from array import array
+from bisect import bisect_right
 from typing import Protocol
+from arcade.shape_list import (
+    create_line_strip, create_rectangle_filled, create_rectangles_filled_with_colors,
+    create_triangles_filled_with_colors,
+)
+
+_COLORS = {}
+
+
+def _shared_color(color) -> tuple:
+    # todos los trazos del mismo color comparten una sola tupla
+    key = tuple(color)
+    return _COLORS.setdefault(key, key)
+
+
+class Trace:
+    # coordenadas planas x0, y0, x1, y1, ... en float32; pueden ser un
+    # memoryview de solo lectura sobre el archivo hasta la primera escritura.
+    # bbox es [izq, abajo, der, arriba]; se calcula al pedirlo y luego crece con cada punto.
+    # __weakref__ deja que storage siga qué trazos todavía leen de un archivo mapeado
+    __slots__ = ("tool", "color", "size", "coords", "bbox", "__weakref__")
+
+    def __init__(self, tool: str, color, pts=(), size: int = 0):
+        self.tool = tool
+        self.color = _shared_color(color)
+        self.size = size
+        self.coords = array("f")
+        self.bbox = [math.inf, math.inf, -math.inf, -math.inf]
+        self.extend(pts)
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def points(self):
+        it = iter(self.coords)
+        return zip(it, it)
+
+    def point_list(self) -> list[tuple[float, float]]:
+        return list(self.points())
+
+    def last(self) -> tuple[float, float]:
+        return self.coords[-2], self.coords[-1]
+
+    def _own(self):
+        if not isinstance(self.coords, array):
+            self.coords = array("f", self.coords)
+
+    def bounds(self) -> list[float]:
+        if self.bbox is None and self.tool == FillTool.name:
+            rects = FillTool.rects(self)
+            self.bbox = [min(r[0] for r in rects), min(r[1] for r in rects),
+                         max(r[2] for r in rects), max(r[3] for r in rects)]
+        if self.bbox is None:
+            xy = np.frombuffer(self.coords, np.float32).reshape(-1, 2)
+            if len(xy):
+                self.bbox = [*map(float, xy.min(axis=0)), *map(float, xy.max(axis=0))]
+            else:
+                self.bbox = [math.inf, math.inf, -math.inf, -math.inf]
+        return self.bbox
+
+    def hit_points(self):
+        # puntos que ven el índice espacial y el borrador; un relleno no guarda
+        # puntos sino corridas, así que se muestrea su interior
+        if self.tool == FillTool.name:
+            return FillTool.samples(self)
+        return self.points()
+
+    def intersects(self, view, pad: float = 0.0) -> bool:
+        l, b, r, t = self.bounds()
+        return l - pad <= view[2] and r + pad >= view[0] and b - pad <= view[3] and t + pad >= view[1]
+
+    def _grow(self, x: float, y: float):
+        box = self.bbox
+        if box is not None:
+            if x < box[0]:
+                box[0] = x
+            if x > box[2]:
+                box[2] = x
+            if y < box[1]:
+                box[1] = y
+            if y > box[3]:
+                box[3] = y
+
+    def append(self, x: float, y: float):
+        self._own()
+        self.coords.append(x)
+        self.coords.append(y)
+        self._grow(x, y)
+
+    def extend(self, pts):
+        self._own()
+        if isinstance(pts, np.ndarray):
+            if len(pts):
+                self.coords.frombytes(pts.astype(np.float32).tobytes())
+                if self.bbox is not None:
+                    lo = pts.min(axis=0)
+                    hi = pts.max(axis=0)
+                    self._grow(float(lo[0]), float(lo[1]))
+                    self._grow(float(hi[0]), float(hi[1]))
+            return
+        for (x, y) in pts:
+            self.coords.append(x)
+            self.coords.append(y)
+            self._grow(x, y)
+
+    def set_last(self, x: float, y: float):
+        # la caja solo crece: puede quedar algo más grande que el trazo, nunca más chica
+        self._own()
+        self.coords[-2] = x
+        self.coords[-1] = y
+        self._grow(x, y)
+
+    def decimated(self, step: float) -> list[tuple[float, float]]:
+        # nivel de detalle: descarta puntos a menos de `step` del último conservado
+        if step <= 0.0 or len(self) <= 2:
+            return self.point_list()
+        step2 = step * step
+        pts = self.points()
+        lx, ly = next(pts)
+        out = [(lx, ly)]
+        x = y = None
+        for (x, y) in pts:
+            dx = x - lx
+            dy = y - ly
+            if dx * dx + dy * dy >= step2:
+                out.append((x, y))
+                lx, ly = x, y
+        if out[-1] != (x, y):
+            out.append((x, y))
+        return out
+
+    def to_dict(self) -> dict:
+        d = {"tool": self.tool, "color": self.color, "trace": self.point_list()}
+        if self.tool == "CELL":
+            d["size"] = self.size
+        return d
+
+    @classmethod
+    def from_coords(cls, tool: str, color, coords, size: int = 0):
+        t = cls(tool, color, (), size)
+        t.coords = coords
+        t.bbox = None
+        return t
+
+    @classmethod
+    def from_dict(cls, d: dict, default_size: int = 16):
+        return cls(d["tool"], d["color"], d["trace"], int(d.get("size", default_size)))
+
+
+def bresenham(x0: int, y0: int, x1: int, y1: int):
+    # celdas de la recta entre (x0, y0) y (x1, y1), ambas incluidas
+    dx = abs(x1 - x0)
+    dy = -abs(y1 - y0)
+    sx = 1 if x0 < x1 else -1
+    sy = 1 if y0 < y1 else -1
+    err = dx + dy
+    while True:
+        yield x0, y0
+        if x0 == x1 and y0 == y1:
+            return
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy
+            x0 += sx
+        if e2 <= dx:
+            err += dx
+            y0 += sy
+
+
+def _seg_dist2(px, py, ax, ay, bx, by):
+    vx = bx - ax
+    vy = by - ay
+    wx = px - ax
+    wy = py - ay
+    l2 = vx * vx + vy * vy
+    if l2 > 0.0:
+        k = max(0.0, min(1.0, (wx * vx + wy * vy) / l2))
+        wx -= k * vx
+        wy -= k * vy
+    return wx * wx + wy * wy
+
+
+class StrokeSimplifier:
+    # Filtro incremental para lápiz y marcador: el último punto del trazo es
+    # provisional y se mueve con el mouse mientras todas las muestras desde el
+    # último punto fijo queden a menos de `tolerance` px de la recta.
+    def __init__(self, tolerance: float = 1.0, max_run: int = 64):
+        self.tolerance = tolerance
+        self.max_run = max_run
+        self.run = []
+
+    def start(self):
+        self.run = []
+
+    def push(self, t: Trace, x: float, y: float):
+        # devuelve el punto que quedó fijo, si hubo uno
+        tol2 = self.tolerance * self.tolerance
+        if not self.run:
+            ax, ay = t.last()
+            if (x - ax) ** 2 + (y - ay) ** 2 <= tol2:
+                return None
+            t.append(x, y)
+            self.run.append((x, y))
+            return None
+        ax, ay = t.coords[-4], t.coords[-3]
+        if len(self.run) < self.max_run and all(_seg_dist2(px, py, ax, ay, x, y) <= tol2 for (px, py) in self.run):
+            t.set_last(x, y)
+            self.run.append((x, y))
+            return None
+        fixed = t.last()
+        t.append(x, y)
+        self.run = [(x, y)]
+        return fixed
+
+    def finish(self, t: Trace):
+        if not self.run:
+            return None
+        self.run = []
+        return t.last()
+
 
 class Tool(Protocol):
     name: str
-    def draw_traces(self, traces: list[dict]):
+    # view = (izq, abajo, der, arriba) en coordenadas del mundo; los trazos fuera no se envían
+    def draw_traces(self, traces: list[Trace], view=None):
         ...
     def get_name(self):
         return self.name
+    def make_shapes(self, t: Trace, step: float = 0.0) -> list:
+        return []
+    def rasterize(self, draw, t: Trace, scale: float = 1.0, left: float = 0.0, top: float = 0.0,
+                  ox: int = 0, oy: int = 0):
+        # versión en CPU (PIL.ImageDraw) para render sin ventana; y crece hacia abajo.
+        # (ox, oy) es el píxel de la imagen completa donde empieza esta imagen (un mosaico)
+        return
+
+
+def _visible(traces, name, view, pad):
+    if view is None:
+        return [t for t in traces if t.tool == name]
+    return [t for t in traces if t.tool == name and t.intersects(view, pad)]
+
+
+def _to_image(pts, scale, left, top, ox=0, oy=0):
+    # se redondea al píxel de la imagen completa y recién después se corre al mosaico,
+    # así cada mosaico dibuja exactamente lo mismo que el render de una sola pasada
+    return [(math.floor((x - left) * scale + 0.5) - ox, math.floor((top - y) * scale + 0.5) - oy)
+            for (x, y) in pts]
+
+
+def _stroke_raster(draw, t, width, scale, left, top, ox, oy):
+    pts = _to_image(t.points(), scale, left, top, ox, oy)
+    w = width * scale
+    if len(pts) >= 2:
+        draw.line(pts, fill=t.color[:3], width=max(1, round(w)), joint="curve")
+    elif len(pts) == 1:
+        x, y = pts[0]
+        draw.rectangle((x - w / 2, y - w / 2, x + w / 2, y + w / 2), fill=t.color[:3])
+
+
+def _stroke_shapes(pts, color, width):
+    if len(pts) >= 2:
+        return [create_line_strip(pts, color, width)]
+    if len(pts) == 1:
+        x, y = pts[0]
+        return [create_rectangle_filled(x, y, width, width, color)]
+    return []
 
 class PencilTool(Tool):
     name = "PENCIL"
-    def draw_traces(self, traces: list[dict]):
-        for t in traces:
-            if t["tool"] == self.name:
-                pts = t["trace"]
-                if len(pts) >= 2:
-                    arcade.draw_line_strip(pts, t["color"], 3)
-                elif len(pts) == 1:
-                    x, y = pts[0]
-                    arcade.draw_point(x, y, t["color"], 3)
+    def draw_traces(self, traces: list[Trace], view=None):
+        for t in _visible(traces, self.name, view, 1.5):
+            if len(t) >= 2:
+                arcade.draw_line_strip(t.point_list(), t.color, 3)
+            elif len(t) == 1:
+                x, y = t.last()
+                arcade.draw_point(x, y, t.color, 3)
+
+    def make_shapes(self, t: Trace, step: float = 0.0) -> list:
+        return _stroke_shapes(t.decimated(step), t.color, 3)
+
+    def rasterize(self, draw, t: Trace, scale: float = 1.0, left: float = 0.0, top: float = 0.0,
+                  ox: int = 0, oy: int = 0):
+        _stroke_raster(draw, t, 3, scale, left, top, ox, oy)
 
 class MarkerTool(Tool):
     name = "MARKER"
-    def draw_traces(self, traces: list[dict]):
-        for t in traces:
-            if t["tool"] == self.name:
-                pts = t["trace"]
-                if len(pts) >= 2:
-                    arcade.draw_line_strip(pts, t["color"], 10)
-                elif len(pts) == 1:
-                    x, y = pts[0]
-                    arcade.draw_point(x, y, t["color"], 10)
+    def draw_traces(self, traces: list[Trace], view=None):
+        for t in _visible(traces, self.name, view, 5.0):
+            if len(t) >= 2:
+                arcade.draw_line_strip(t.point_list(), t.color, 10)
+            elif len(t) == 1:
+                x, y = t.last()
+                arcade.draw_point(x, y, t.color, 10)
+
+    def make_shapes(self, t: Trace, step: float = 0.0) -> list:
+        return _stroke_shapes(t.decimated(step), t.color, 10)
+
+    def rasterize(self, draw, t: Trace, scale: float = 1.0, left: float = 0.0, top: float = 0.0,
+                  ox: int = 0, oy: int = 0):
+        _stroke_raster(draw, t, 10, scale, left, top, ox, oy)
 
 class SprayTool(Tool):
     name = "SPRAY"
-    def draw_traces(self, traces: list[dict]):
-        for t in traces:
-            if t["tool"] == self.name and t["trace"]:
-                arcade.draw_points(t["trace"], t["color"], 5)
+    RATE = 1200.0  # puntos por segundo mientras se mantiene presionado
+    BURST = 28     # puntos del clic inicial
+    def draw_traces(self, traces: list[Trace], view=None):
+        for t in _visible(traces, self.name, view, 2.5):
+            if len(t):
+                arcade.draw_points(t.point_list(), t.color, 5)
+
+    def make_shapes(self, t: Trace, step: float = 0.0) -> list:
+        # mismos cuadrados de 5px que draw_points, pero en un solo buffer de triángulos;
+        # con step > 0 queda un punto por celda de 2·step (menos de un cuadrado en pantalla)
+        h = 2.5
+        pts = t.points()
+        if step > 0.0 and len(t):
+            xy = np.frombuffer(t.coords, np.float32).reshape(-1, 2)
+            _, first = np.unique(np.floor(xy / (2.0 * step)).astype(np.int64), axis=0, return_index=True)
+            pts = xy[np.sort(first)].tolist()
+        verts = []
+        for (x, y) in pts:
+            verts += [(x - h, y - h), (x + h, y - h), (x + h, y + h),
+                      (x - h, y - h), (x + h, y + h), (x - h, y + h)]
+        if not verts:
+            return []
+        return [create_triangles_filled_with_colors(verts, [t.color] * len(verts))]
+
+    def rasterize(self, draw, t: Trace, scale: float = 1.0, left: float = 0.0, top: float = 0.0,
+                  ox: int = 0, oy: int = 0):
+        h = 2.5 * scale
+        color = t.color[:3]
+        for (x, y) in _to_image(t.points(), scale, left, top, ox, oy):
+            draw.rectangle((x - h, y - h, x + h, y + h), fill=color)
 
     @staticmethod
-    def scatter(cx: float, cy: float, count: int = 28, radius: float = 16.0):
-        pts = []
-        for _ in range(count):
-            r = random.uniform(0.0, radius)
-            a = random.uniform(0.0, 2.0 * math.pi)
-            pts.append((cx + r * math.cos(a), cy + r * math.sin(a)))
+    def scatter(cx: float, cy: float, count: int = 28, radius: float = 16.0, rng=None):
+        # misma distribución que antes (radio y ángulo uniformes), en un solo lote
+        rng = _RNG if rng is None else rng
+        r = rng.uniform(0.0, radius, count)
+        a = rng.uniform(0.0, 2.0 * math.pi, count)
+        return np.column_stack((cx + r * np.cos(a), cy + r * np.sin(a))).astype(np.float32)
+
+    @staticmethod
+    def scatter_along(x0: float, y0: float, x1: float, y1: float, count: int, radius: float = 16.0, rng=None):
+        # como scatter, pero con el centro repartido sobre el tramo recorrido en el frame
+        rng = _RNG if rng is None else rng
+        pts = SprayTool.scatter(0.0, 0.0, count, radius, rng)
+        k = rng.uniform(0.0, 1.0, count)
+        pts[:, 0] += x0 + (x1 - x0) * k
+        pts[:, 1] += y0 + (y1 - y0) * k
         return pts
 
+
+_RNG = np.random.default_rng()
+
+
+class SprayCoverage:
+    # Densidad del trazo de spray en curso: cuenta puntos por celda de `cell` px
+    # y descarta los que caen en celdas que ya llegaron a `cap`.
+    def __init__(self, cell: float = 4.0, cap: int = 2):
+        self.cell = cell
+        self.cap = cap
+        self.counts = {}
+
+    def accept(self, pts: np.ndarray) -> np.ndarray:
+        if not len(pts):
+            return pts
+        keys = np.floor(pts / self.cell).astype(np.int64)
+        keys = (keys[:, 0] << 32) ^ (keys[:, 1] & 0xFFFFFFFF)
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        counts = self.counts
+        used = np.fromiter((counts.get(k, 0) for k in uniq.tolist()), np.int64, len(uniq))
+        # posición de cada punto dentro de su celda en este lote
+        order = np.argsort(inverse, kind="stable")
+        ranks = np.empty(len(pts), np.int64)
+        group = inverse[order]
+        starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+        ranks[order] = np.arange(len(pts)) - np.repeat(starts, np.diff(np.r_[starts, len(pts)]))
+        keep = ranks < self.cap - used[inverse]
+        added = np.bincount(inverse[keep], minlength=len(uniq))
+        for k, n in zip(uniq[added > 0].tolist(), added[added > 0].tolist()):
+            counts[k] = counts.get(k, 0) + n
+        return pts[keep]
+
 class CellTool(Tool):
     name = "CELL"
-    def draw_traces(self, traces: list[dict]):
+    def draw_traces(self, traces: list[Trace], view=None):
         for t in traces:
-            if t["tool"] == self.name:
-                size = t.get("size", 16)
-                half = size / 2
-                for (x, y) in t["trace"]:
-                    arcade.draw_lrbt_rectangle_filled(x - half, x + half, y - half, y + half, t["color"])
+            if t.tool == self.name and (view is None or t.intersects(view, t.size / 2)):
+                half = t.size / 2
+                for (x, y) in t.points():
+                    arcade.draw_lrbt_rectangle_filled(x - half, x + half, y - half, y + half, t.color)
                     arcade.draw_lrbt_rectangle_outline(x - half, x + half, y - half, y + half, arcade.color.BLACK, 1)
 
+    def rasterize(self, draw, t: Trace, scale: float = 1.0, left: float = 0.0, top: float = 0.0,
+                  ox: int = 0, oy: int = 0):
+        half = t.size / 2 * scale
+        border = max(1, round(scale))
+        for (x, y) in _to_image(t.points(), scale, left, top, ox, oy):
+            draw.rectangle((x - half, y - half, x + half, y + half), fill=t.color[:3], outline=(0, 0, 0), width=border)
+
+class FillTool(Tool):
+    # Relleno por corridas sobre el lienzo rasterizado. El trazo guarda una máscara RLE:
+    #   coords[0:4]  origen (x, y) del píxel (0, 0), lado del píxel y ancho W de la máscara
+    #   resto        pares (inicio, largo) sobre los píxeles en orden fila * W + columna,
+    #                con la fila 0 abajo; una corrida puede seguir en la fila siguiente
+    name = "FILL"
+    TOLERANCE = 32  # diferencia máxima por canal con el color del píxel de partida
+    SAMPLE = 8.0    # separación de los puntos de muestra para el borrador, en píxeles de la máscara
+
+    @staticmethod
+    def rects(t: Trace) -> list[tuple[float, float, float, float]]:
+        # rectángulos (izq, abajo, der, arriba) del mundo: una corrida que cruza filas
+        # queda como su primera fila parcial, un bloque de filas completas y la última parcial
+        c = t.coords
+        ox, oy, h, w = c[0], c[1], c[2], int(c[3])
+        out = []
+        for k in range(4, len(c), 2):
+            s = int(c[k])
+            r0, c0 = divmod(s, w)
+            r1, c1 = divmod(s + int(c[k + 1]), w)
+            if r0 == r1:
+                out.append((r0, r0 + 1, c0, c1))
+                continue
+            if c0:
+                out.append((r0, r0 + 1, c0, w))
+                r0 += 1
+            if r1 > r0:
+                out.append((r0, r1, 0, w))
+            if c1:
+                out.append((r1, r1 + 1, 0, c1))
+        return [(ox + a * h, oy + r0 * h, ox + b * h, oy + r1 * h) for (r0, r1, a, b) in out]
+
+    @staticmethod
+    def samples(t: Trace) -> list[tuple[float, float]]:
+        # una rejilla de puntos dentro de cada rectángulo (al menos su centro)
+        spacing = FillTool.SAMPLE * t.coords[2]
+        rects = np.asarray(FillTool.rects(t), np.float64).reshape(-1, 4)
+        w = rects[:, 2] - rects[:, 0]
+        h = rects[:, 3] - rects[:, 1]
+        nx = np.maximum(1, (w // spacing).astype(np.int64))
+        ny = np.maximum(1, (h // spacing).astype(np.int64))
+        counts = nx * ny
+        owner = np.repeat(np.arange(len(rects)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        xs = rects[owner, 0] + (k % nx[owner] + 0.5) * (w / nx)[owner]
+        ys = rects[owner, 1] + (k // nx[owner] + 0.5) * (h / ny)[owner]
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def draw_traces(self, traces: list[Trace], view=None):
+        # cientos de rectángulos por relleno: un solo buffer en vez de uno por rectángulo
+        for t in _visible(traces, self.name, view, 0.0):
+            for shape in self.make_shapes(t):
+                shape.draw()
+
+    def make_shapes(self, t: Trace, step: float = 0.0) -> list:
+        pts = []
+        for (l, b, r, top) in self.rects(t):
+            pts += [(l, b), (r, b), (r, top), (l, top)]
+        if not pts:
+            return []
+        return [create_rectangles_filled_with_colors(pts, [t.color] * len(pts))]
+
+    def rasterize(self, draw, t: Trace, scale: float = 1.0, left: float = 0.0, top: float = 0.0,
+                  ox: int = 0, oy: int = 0):
+        # PIL incluye ambos bordes del rectángulo: se resta 1 para no pisar al vecino
+        color = t.color[:3]
+        for (l, b, r, tp) in self.rects(t):
+            x0 = round((l - left) * scale) - ox
+            x1 = round((r - left) * scale) - 1 - ox
+            y0 = round((top - tp) * scale) - oy
+            y1 = round((top - b) * scale) - 1 - oy
+            if x1 >= x0 and y1 >= y0:
+                draw.rectangle((x0, y0, x1, y1), fill=color)
+
+    @staticmethod
+    def fill(rgba: np.ndarray, sx: int, sy: int, color, background, origin, pixel: float,
+             tolerance: int = TOLERANCE):
+        # rgba: (alto, ancho, 4) uint8 con la fila 0 abajo (como lo lee OpenGL); lo
+        # transparente se compone sobre `background`. Devuelve None si no hay nada que pintar
+        height, width = rgba.shape[:2]
+        if not (0 <= sx < width and 0 <= sy < height):
+            return None
+        # un plano contiguo por canal: comparar así es mucho más rápido que sobre RGBA intercalado
+        alpha = rgba[:, :, 3]
+        planes = np.ascontiguousarray(np.moveaxis(rgba[:, :, :3], 2, 0))
+        empty = alpha == 0
+        partial = (alpha > 0) & (alpha < 255)
+        for plane, value in zip(planes, background[:3]):
+            plane[empty] = value
+            if partial.any():
+                a = alpha[partial].astype(np.uint16)
+                plane[partial] = (plane[partial] * a + value * (255 - a)) // 255
+        seed = planes[:, sy, sx].tolist()
+        if seed == list(color[:3]):
+            return None
+        # |canal - semilla| <= tolerancia, con la resta en uint8 que da la vuelta
+        similar = np.ones(alpha.shape, bool)
+        for plane, value in zip(planes, seed):
+            lo = max(0, value - tolerance)
+            hi = min(255, value + tolerance)
+            similar &= (plane - np.uint8(lo)) <= hi - lo
+        runs = scanline_fill(similar, sx, sy)
+        ox, oy = origin
+        t = Trace.from_coords(FillTool.name, color, array("f", [ox, oy, pixel, width]))
+        t.coords.frombytes(runs.astype(np.float32).tobytes())
+        return t
+
+
+def scanline_fill(similar: np.ndarray, sx: int, sy: int) -> np.ndarray:
+    # Relleno por corridas: cada fila de `similar` se parte en corridas [inicio, fin)
+    # con np.diff y se recorren, desde la del punto de partida, las corridas vecinas
+    # que se tocan en la fila de arriba y la de abajo (conexión de 4).
+    # Devuelve pares (inicio, largo) sobre el arreglo aplanado, ya fusionados.
+    height, width = similar.shape
+    padded = np.zeros((height, width + 2), np.int8)
+    padded[:, 1:-1] = similar
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[1]
+    first = np.searchsorted(rows, np.arange(height + 1)).tolist()
+    starts = starts.tolist()
+    ends = ends.tolist()
+    lo, hi = first[sy], first[sy + 1]
+    k = bisect_right(ends, sx, lo, hi)
+    if k >= hi or starts[k] > sx:
+        return np.zeros((0, 2), np.int64)
+    seen = {k}
+    stack = [(k, sy)]
+    while stack:
+        k, row = stack.pop()
+        a, b = starts[k], ends[k]
+        for r in (row - 1, row + 1):
+            if 0 <= r < height:
+                j = bisect_right(ends, a, first[r], first[r + 1])
+                while j < first[r + 1] and starts[j] < b:
+                    if j not in seen:
+                        seen.add(j)
+                        stack.append((j, r))
+                    j += 1
+    ids = np.fromiter(seen, np.int64, len(seen))
+    flat_starts = rows[ids] * width + np.asarray(starts)[ids]
+    flat_ends = rows[ids] * width + np.asarray(ends)[ids]
+    order = np.argsort(flat_starts)
+    flat_starts = flat_starts[order]
+    flat_ends = flat_ends[order]
+    # una corrida que llega al borde derecho sigue en la siguiente si esa arranca en la columna 0
+    keep = np.r_[True, flat_starts[1:] != flat_ends[:-1]]
+    run_starts = flat_starts[keep]
+    run_ends = np.r_[flat_ends[np.flatnonzero(keep)[1:] - 1], flat_ends[-1]]
+    return np.column_stack((run_starts, run_ends - run_starts))
+
+
 class EraserTool(Tool):
     name = "ERASER"
-    def draw_traces(self, traces: list[dict]):
+    RADIUS = 12.0
+    def draw_traces(self, traces: list[Trace], view=None):
         return
 
-    def erase_at(self, traces: list[dict], x: float, y: float, radius: float = 12.0):
-        r2 = radius * radius
-        keep = []
-        for t in traces:
-            pts = t["trace"]
-            hit = False
-            for (px, py) in pts:
-                dx = px - x
-                dy = py - y
-                if dx * dx + dy * dy <= r2:
-                    hit = True
-                    break
-            if not hit:
-                keep.append(t)
-        traces.clear()
-        traces.extend(keep)
+    def erase_at(self, traces: list[Trace], x: float, y: float, radius: float = RADIUS, index=None):
+        # borra lo que cae dentro del círculo: lápiz y marcador se parten en el tramo
+        # borrado, de las celdas y el spray se quitan solo los puntos alcanzados y un
+        # relleno se quita entero. Devuelve los reemplazos en el orden en que se hicieron:
+        # (índice, trazo quitado, trazos que quedaron en su lugar a partir de ese índice)
+        if index is not None:
+            # el store ubica cada trazo por su clave de orden, sin recorrer la lista
+            hit = sorted(((traces.index(t), t) for t in index.hits(x, y, radius + index.STEP / 2)),
+                         key=lambda p: p[0], reverse=True)
+        else:
+            hit = list(enumerate(traces))[::-1]
+        # de mayor a menor índice: un reemplazo no corre los índices que faltan
+        edits = []
+        for i, t in hit:
+            pieces = self.cut(t, x, y, radius)
+            if pieces is None:
+                continue
+            if index is not None:
+                index.remove(t)
+            del traces[i]
+            for k, piece in enumerate(pieces):
+                traces.insert(i + k, piece)
+                if index is not None:
+                    index.add_trace(piece)
+            edits.append((i, t, pieces))
+        return edits
+
+    def erase_along(self, traces: list[Trace], start, pts, radius: float = RADIUS, index=None):
+        # borra sobre el recorrido desde `start` pasando por `pts`, con muestras cada
+        # `radius` px para que un movimiento rápido no deje huecos; mismo orden que erase_at
+        edits = []
+        px, py = start
+        for (x, y) in pts:
+            n = max(1, math.ceil(math.hypot(x - px, y - py) / radius))
+            for k in range(1, n + 1):
+                edits += self.erase_at(traces, px + (x - px) * k / n, py + (y - py) * k / n, radius, index)
+            px, py = x, y
+        return edits
+
+    @staticmethod
+    def cut(t: Trace, x: float, y: float, radius: float):
+        # lo que queda de `t` fuera del círculo, o None si no lo toca
+        if t.tool == FillTool.name:
+            pts = np.asarray(FillTool.samples(t), np.float64).reshape(-1, 2)
+            if (((pts[:, 0] - x) ** 2 + (pts[:, 1] - y) ** 2) <= radius * radius).any():
+                return []
+            return None
+        xy = np.frombuffer(t.coords, np.float32).reshape(-1, 2).astype(np.float64)
+        if not len(xy):
+            return None
+        if t.tool in (PencilTool.name, MarkerTool.name) and len(xy) > 1:
+            pieces = _cut_stroke(xy, x, y, radius)
+            if pieces is None:
+                return None
+        else:
+            # celdas, spray y trazos de un solo punto: cada punto es independiente
+            inside = ((xy[:, 0] - x) ** 2 + (xy[:, 1] - y) ** 2) <= radius * radius
+            if not inside.any():
+                return None
+            kept = xy[~inside]
+            pieces = [kept] if len(kept) else []
+        return [Trace(t.tool, t.color, piece, t.size) for piece in pieces]
+
+
+def _cut_stroke(xy: np.ndarray, x: float, y: float, radius: float):
+    # intersección de cada segmento a + s·d (s en [0, 1]) con el círculo: el tramo
+    # [lo, hi] de s que queda adentro. Los pedazos de afuera siguen la polilínea y
+    # terminan justo en el borde del círculo
+    a = xy[:-1]
+    d = xy[1:] - a
+    f = a - (x, y)
+    qa = (d * d).sum(axis=1)
+    qb = 2.0 * (f * d).sum(axis=1)
+    qc = (f * f).sum(axis=1) - radius * radius
+    disc = qb * qb - 4.0 * qa * qc
+    with np.errstate(divide="ignore", invalid="ignore"):
+        root = np.sqrt(np.maximum(disc, 0.0))
+        lo = np.maximum((-qb - root) / (2.0 * qa), 0.0)
+        hi = np.minimum((-qb + root) / (2.0 * qa), 1.0)
+    # un segmento de largo 0 está adentro o afuera entero
+    point = qa == 0.0
+    lo[point] = 0.0
+    hi[point] = 1.0
+    inside = np.where(point, qc <= 0.0, (disc > 0.0) & (lo < hi))
+    hits = np.flatnonzero(inside)
+    if not len(hits):
+        return None
+    pieces = []
+    # pedazo abierto: (primer punto, índice del siguiente vértice que le pertenece)
+    cur = (xy[0], 1) if qc[0] > 0.0 else None
+    for k in hits:
+        if cur is not None:
+            head, j = cur
+            if lo[k] > 0.0:
+                piece = np.concatenate([head[None], xy[j:k + 1], (a[k] + lo[k] * d[k])[None]])
+            else:
+                piece = np.concatenate([head[None], xy[j:k]])
+            if len(piece) > 1:
+                pieces.append(piece)
+        cur = (a[k] + hi[k] * d[k], k + 1) if hi[k] < 1.0 else None
+    if cur is not None:
+        head, j = cur
+        piece = np.concatenate([head[None], xy[j:]])
+        if len(piece) > 1:
+            pieces.append(piece)
+    return pieces